@@ -6,10 +6,16 @@ Interactive treemap display of disk usage
 
 import os
 import json
+import heapq
+import sqlite3
 import threading
 import time
 from flask import Flask, render_template, jsonify, request
 from scanner import StorageScanner
+from duplicates import DuplicateFinder
+from scan_store import ScanStore
+from scan_index import ScanIndex
+from history import ScanHistory, ScanScheduler
 
 app = Flask(__name__)
 
@@ -18,6 +24,22 @@ scan_progress = {"status": "idle", "progress": 0, "current_path": "", "total_siz
 scan_results = None
 scan_thread = None
 scan_cancelled = False
+scan_generation = 0
+scan_file_index = None  # None unless the last scan tracked files
+scan_store = None
+scan_index = None
+scan_index_lock = threading.Lock()
+
+# Global variables for scheduled scans and size history
+history_db_path = os.environ.get('VIZDISK_HISTORY_DB', os.path.expanduser('~/.vizdisk/history.sqlite'))
+scan_history = None
+scan_scheduler = None
+
+# Global variables for duplicate search state
+duplicate_progress = {"status": "idle", "stage": "", "progress": 0}
+duplicate_results = None
+duplicate_thread = None
+duplicate_cancelled = False
 
 @app.route('/')
 def index():
@@ -27,21 +49,29 @@ def index():
 @app.route('/scan', methods=['POST'])
 def start_scan():
     """Start filesystem scanning"""
-    global scan_thread, scan_progress, scan_results, scan_cancelled
+    global scan_thread, scan_progress, scan_results, scan_cancelled, scan_file_index, scan_store, scan_generation
+    global duplicate_cancelled
     
     data = request.get_json()
     scan_path = data.get('path', os.path.expanduser('~/Downloads'))  # Default to user Downloads
     exclude_dirs = data.get('exclude_dirs', [])
+    # Preview mode: return a sampled estimate first, then optionally refine with an exact scan
+    preview = bool(data.get('preview', False))
+    refine = bool(data.get('refine', True))
+    # Recording every file costs memory for the whole tree, so only do it when asked
+    track_files = bool(data.get('track_files', False))
+    # "sqlite" keeps scan records on disk so memory stays bounded on huge filesystems
+    backend = data.get('backend', 'memory')
+    if backend not in ('memory', 'sqlite'):
+        return jsonify({"error": f"Unknown scan backend: {backend}"}), 400
     
     # Check if path is too dangerous to scan (only exclude container-specific paths)
     dangerous_paths = ['/home/runner/.nix-defexpr', '/home/runner/.cache', '/nix', '/mnt']
     if any(scan_path.startswith(dangerous) for dangerous in dangerous_paths):
         return jsonify({"error": "Cannot scan container system directories. Please choose a different directory."}), 400
     
-    # Reset scan state
-    scan_progress = {"status": "scanning", "progress": 0, "current_path": "", "total_size": 0}
-    scan_results = None
-    scan_cancelled = False
+    # Sizes from the previous scan help prioritise the next one
+    previous_sizes = StorageScanner().get_directory_sizes(scan_results) if scan_results else {}
     
     # Start scanning in a separate thread with smart optimizations
     if scan_path == '/':
@@ -49,9 +79,48 @@ def start_scan():
         max_depth = 6  # Limit depth to 6 levels
     else:
         max_depth = None
+    # Still count everything below max_depth so totals aren't undercounted
+    aggregate_below_depth = bool(data.get('aggregate_below_depth', True))
+    # "largest_first" resolves big directories early so partial scans are useful
+    schedule = data.get('schedule', 'listdir')
+    if backend == 'sqlite' and schedule != 'listdir':
+        return jsonify({"error": "The sqlite backend only supports the listdir schedule"}), 400
+    
+    # Metadata calls on network/FUSE mounts time out instead of hanging the scan (null disables it)
+    metadata_timeout = data.get('metadata_timeout', 10)
+    if metadata_timeout is not None:
+        try:
+            metadata_timeout = float(metadata_timeout)
+        except (TypeError, ValueError):
+            return jsonify({"error": "metadata_timeout must be a number of seconds"}), 400
+        if not metadata_timeout > 0:
+            return jsonify({"error": "metadata_timeout must be greater than 0"}), 400
+    
+    try:
+        scanner = StorageScanner(exclude_dirs, max_depth=max_depth, track_files=track_files,
+                                 aggregate_below_depth=aggregate_below_depth, schedule=schedule,
+                                 size_hints=previous_sizes, metadata_timeout=metadata_timeout)
+    except ValueError as e:
+        return jsonify({"error": str(e)}), 400
     
-    scanner = StorageScanner(exclude_dirs, max_depth=max_depth)
-    scan_thread = threading.Thread(target=run_scan, args=(scanner, scan_path))
+    # Reset scan state
+    scan_progress = {"status": "previewing" if preview else "scanning", "progress": 0, "current_path": "", "total_size": 0}
+    scan_results = None
+    scan_cancelled = False
+    scan_generation += 1
+    scan_file_index = None
+    if duplicate_thread is not None and duplicate_thread.is_alive():
+        # It is reading the previous scan's file index
+        duplicate_cancelled = True
+        duplicate_progress["status"] = "cancelled"
+    if scan_store is not None:
+        # Queries and duplicate searches still reading it finish before it is deleted
+        scan_store.close()
+        scan_store = None
+    if backend == 'sqlite':
+        scan_store = ScanStore()
+    
+    scan_thread = threading.Thread(target=run_scan, args=(scanner, scan_path, preview, refine, scan_store, scan_generation))
     scan_thread.daemon = True
     scan_thread.start()
     
@@ -67,39 +136,202 @@ def stop_scan():
     
     return jsonify({"status": "cancelled"})
 
-def run_scan(scanner, path):
+def run_scan(scanner, path, preview=False, refine=True, store=None, generation=None):
     """Run the filesystem scan in a separate thread"""
-    global scan_progress, scan_results, scan_cancelled
+    global scan_results, scan_file_index
+    
+    # A scan stuck on a hung mount may outlive its successor; it must never
+    # overwrite the newer scan's progress or results
+    progress = scan_progress
+    
+    def superseded():
+        return generation is not None and generation != scan_generation
     
     try:
+        if preview:
+            def preview_callback(current_path, elapsed, time_budget):
+                if scan_cancelled or superseded():
+                    return False
+                progress["current_path"] = current_path
+                progress["progress"] = min(int((elapsed / max(time_budget, 0.001)) * 100), 100)
+                return True
+            
+            print(f"Starting preview of: {path}")
+            estimate = scanner.preview_directory(path, preview_callback)
+            
+            if scan_cancelled or superseded():
+                progress["status"] = "cancelled"
+                return
+            
+            if estimate:
+                # Serve the estimate immediately; an exact scan may replace it below
+                scan_results = estimate
+                progress["preview_ready"] = True
+                progress["total_size"] = estimate.get("size", 0)
+                progress["size_error"] = estimate.get("size_error", 0)
+            
+            if not refine:
+                progress["status"] = "completed" if estimate else "error"
+                if not estimate:
+                    progress["error"] = "No results returned from preview"
+                return
+            
+            progress["status"] = "refining"
+            progress["progress"] = 0
+        
         def progress_callback(current_path, processed_items, total_items):
-            global scan_cancelled
-            if scan_cancelled:
+            if scan_cancelled or superseded():
                 return False  # Signal to stop scanning
-            scan_progress["current_path"] = current_path
-            scan_progress["progress"] = min(int((processed_items / max(total_items, 1)) * 100), 100)  # Cap at 100%
+            progress["current_path"] = current_path
+            progress["progress"] = min(int((processed_items / max(total_items, 1)) * 100), 100)  # Cap at 100%
             return True
         
         print(f"Starting scan of: {path}")
-        results = scanner.scan_directory(path, progress_callback)
+        if store is not None:
+            # Held so a newer scan replacing the store can't delete it mid-write
+            with store.writing():
+                summary = scanner.scan_to_store(path, store, progress_callback)
+                # Only a bounded, largest-first slice of the store is loaded for the treemap
+                results = store.load_tree() if summary else None
+        else:
+            results = scanner.scan_directory(path, progress_callback)
+        
+        if superseded():
+            print(f"Discarding results of superseded scan: {path}")
+            return
         
         if scan_cancelled:
-            scan_progress["status"] = "cancelled"
+            progress["status"] = "cancelled"
+            if results and results.get("partial"):
+                # Largest-first scans stop with the dominant subtrees already resolved
+                scan_results = results
+                progress["partial_results"] = True
+                progress["total_size"] = results.get("size", 0)
             return
             
         if results:
             scan_results = results
-            scan_progress["status"] = "completed"
-            scan_progress["total_size"] = results.get("size", 0)
+            # The store always keeps files over 1MB, so it can be searched either way
+            if store is not None:
+                scan_file_index = store
+            elif scanner.track_files:
+                scan_file_index = scanner.file_index
+            progress["status"] = "completed"
+            progress["total_size"] = results.get("size", 0)
+            if results.get("incomplete_paths"):
+                # Subtrees that timed out on slow mounts are reported rather than blocking the scan
+                progress["incomplete_paths"] = results["incomplete_paths"]
         else:
-            scan_progress["status"] = "error"
-            scan_progress["error"] = "No results returned from scan"
+            progress["status"] = "error"
+            progress["error"] = "No results returned from scan"
         print(f"Scan completed. Total size: {results.get('size', 0) if results else 0} bytes")
         
     except Exception as e:
         print(f"Scan error: {str(e)}")
-        scan_progress["status"] = "error"
-        scan_progress["error"] = str(e)
+        progress["status"] = "error"
+        progress["error"] = str(e)
+
+@app.route('/find_duplicates', methods=['POST'])
+def start_duplicate_search():
+    """Start a duplicate file search over the last scan"""
+    global duplicate_thread, duplicate_progress, duplicate_results, duplicate_cancelled
+    
+    if scan_results is None:
+        return jsonify({"error": "No results available"}), 404
+    
+    if scan_file_index is None:
+        return jsonify({"error": "Last scan did not track files; rescan with \"track_files\": true"}), 409
+    
+    if duplicate_thread is not None and duplicate_thread.is_alive():
+        return jsonify({"error": "Duplicate search already running"}), 409
+    
+    data = request.get_json(silent=True) or {}
+    # Tiny files reclaim little space and dominate the hashing cost
+    try:
+        min_size = int(data.get('min_size', 1024 * 1024))
+    except (TypeError, ValueError):
+        return jsonify({"error": "min_size must be an integer"}), 400
+    
+    duplicate_progress = {"status": "searching", "stage": "size", "progress": 0}
+    duplicate_results = None
+    duplicate_cancelled = False
+    
+    finder = DuplicateFinder(min_size=min_size)
+    file_index = scan_file_index
+    if isinstance(file_index, ScanStore):
+        # Let SQLite drop files with a unique size so memory stays bounded
+        file_index = file_index.size_collisions(finder.min_size)
+    duplicate_thread = threading.Thread(target=run_duplicate_search, args=(finder, file_index))
+    duplicate_thread.daemon = True
+    duplicate_thread.start()
+    
+    return jsonify({"status": "started"})
+
+@app.route('/stop_duplicates', methods=['POST'])
+def stop_duplicate_search():
+    """Stop current duplicate search"""
+    global duplicate_cancelled
+    
+    duplicate_cancelled = True
+    duplicate_progress["status"] = "cancelled"
+    
+    return jsonify({"status": "cancelled"})
+
+def run_duplicate_search(finder, file_index):
+    """Run the duplicate search in a separate thread"""
+    global duplicate_progress, duplicate_results
+    
+    try:
+        def progress_callback(stage, processed, total):
+            if duplicate_cancelled:
+                return False
+            duplicate_progress["stage"] = stage
+            duplicate_progress["progress"] = min(int((processed / max(total, 1)) * 100), 100)
+            duplicate_progress["bytes_read"] = finder.stats.get("bytes_read", 0)
+            return True
+        
+        duplicate_sets = finder.find_duplicates(file_index, progress_callback)
+        
+        if duplicate_cancelled:
+            duplicate_progress["status"] = "cancelled"
+            return
+        
+        duplicate_results = {
+            "sets": duplicate_sets,
+            "total_wasted": sum(item["wasted_bytes"] for item in duplicate_sets),
+            "stats": dict(finder.stats)
+        }
+        duplicate_progress["status"] = "completed"
+        duplicate_progress["progress"] = 100
+        duplicate_progress["bytes_read"] = finder.stats["bytes_read"]
+        duplicate_progress["throughput"] = finder.stats["throughput"]
+        
+    except Exception as e:
+        print(f"Duplicate search error: {str(e)}")
+        duplicate_progress["status"] = "error"
+        duplicate_progress["error"] = str(e)
+
+@app.route('/duplicates_progress')
+def get_duplicate_progress():
+    """Get current duplicate search progress"""
+    return jsonify(duplicate_progress)
+
+@app.route('/duplicates')
+def get_duplicates():
+    """Get duplicate sets ranked by wasted bytes"""
+    if duplicate_results is None:
+        return jsonify({"error": "No duplicate results available"}), 404
+    
+    limit = request.args.get('limit', 100, type=int)
+    sets = duplicate_results["sets"][:limit]
+    
+    return jsonify({
+        "sets": [dict(item, wasted_formatted=format_size(item["wasted_bytes"])) for item in sets],
+        "set_count": len(duplicate_results["sets"]),
+        "total_wasted": duplicate_results["total_wasted"],
+        "total_wasted_formatted": format_size(duplicate_results["total_wasted"]),
+        "stats": duplicate_results["stats"]
+    })
 
 @app.route('/progress')
 def get_progress():
@@ -114,121 +346,143 @@ def get_results():
     
     return jsonify(scan_results)
 
+@app.route('/directory_children')
+def get_directory_children():
+    """Get the largest children of a directory from the on-disk scan store"""
+    store = scan_store  # A new scan may replace it mid-request
+    if store is None or not store.finalized:
+        return jsonify({"error": "No scan store available"}), 404
+    
+    path = request.args.get('path', store.root_path)
+    limit = request.args.get('limit', 50, type=int)
+    offset = request.args.get('offset', 0, type=int)
+    
+    try:
+        children = store.children(path, limit=limit, offset=offset)
+    except sqlite3.ProgrammingError:
+        return jsonify({"error": "Scan store was replaced by a new scan"}), 409
+    if children is None:
+        return jsonify({"error": f"Path not in scan: {path}"}), 404
+    
+    return jsonify({"path": path, "children": children, "offset": offset, "limit": limit})
+
+@app.route('/top_items')
+def get_top_items():
+    """Get the largest directories and files from the on-disk scan store"""
+    store = scan_store  # A new scan may replace it mid-request
+    if store is None or not store.finalized:
+        return jsonify({"error": "No scan store available"}), 404
+    
+    limit = request.args.get('limit', 20, type=int)
+    try:
+        return jsonify({
+            "directories": store.top_directories(limit),
+            "files": store.top_files(limit)
+        })
+    except sqlite3.ProgrammingError:
+        return jsonify({"error": "Scan store was replaced by a new scan"}), 409
+
+@app.route('/query')
+def query_results():
+    """
+    Filter scan results by size range, path prefix, name pattern and type
+    
+    Only "*.ext" patterns are indexed; other patterns are matched against every
+    name left by the size and prefix filters.
+    """
+    global scan_index
+    
+    try:
+        filters = {
+            "min_size": parse_size(request.args.get('min_size')),
+            "max_size": parse_size(request.args.get('max_size')),
+            "prefix": request.args.get('prefix'),
+            "pattern": request.args.get('pattern'),
+            "kind": request.args.get('type'),
+            "offset": max(request.args.get('offset', 0, type=int), 0),
+            "limit": min(max(request.args.get('limit', 100, type=int), 1), 1000)
+        }
+    except ValueError as e:
+        return jsonify({"error": str(e)}), 400
+    
+    if filters["kind"] not in (None, 'file', 'directory'):
+        return jsonify({"error": "type must be 'file' or 'directory'"}), 400
+    
+    # The store holds every record, so query it directly instead of the loaded slice
+    store = scan_store  # A new scan may replace it mid-request
+    if store is not None and store.finalized:
+        try:
+            return jsonify(store.query(**filters))
+        except sqlite3.ProgrammingError:
+            return jsonify({"error": "Scan store was replaced by a new scan"}), 409
+    
+    if scan_results is None:
+        return jsonify({"error": "No results available"}), 404
+    
+    # Build the indexes once per scan result
+    with scan_index_lock:
+        if scan_index is None or scan_index.source is not scan_results:
+            scan_index = ScanIndex(scan_results)
+        index = scan_index
+    
+    return jsonify(index.query(**filters))
+
 @app.route('/treemap_data')
 def get_treemap_data():
     """Get data formatted for Plotly treemap"""
     if scan_results is None:
         return jsonify({"error": "No results available"}), 404
     
-    # Prune the data first to reduce size
-    pruned_data = prune_scan_data(scan_results)
+    max_nodes = min(max(request.args.get('max_nodes', 300, type=int), 1), 5000)
+    max_bytes = min(max(request.args.get('max_bytes', 5 * 1024 * 1024, type=int), 1024), 64 * 1024 * 1024)
     
-    # Convert scan results to treemap format
-    treemap_data = convert_to_treemap_format(pruned_data)
+    treemap_data = select_treemap_nodes(scan_results, max_nodes=max_nodes, max_bytes=max_bytes)
     return jsonify(treemap_data)
 
-def prune_scan_data(data, max_size_mb=5):
-    """Prune scan data to reduce memory usage"""
-    import json
-    import copy
-    
-    # Create a copy to avoid modifying original
-    pruned = copy.deepcopy(data)
-    
-    def prune_node(node, depth=0):
-        # Remove very deep nesting
-        if depth > 6:
-            node["children"] = []
-            return node
-            
-        # Keep only the largest children
-        children = node.get("children", [])
-        if children:
-            children.sort(key=lambda x: x["size"], reverse=True)
-            max_children = max(25 - depth * 3, 8)  # Fewer children at deeper levels
-            node["children"] = children[:max_children]
-            
-            # Recursively prune children
-            for child in node["children"]:
-                prune_node(child, depth + 1)
-        
-        return node
+def select_treemap_nodes(data, max_nodes=300, max_bytes=None):
+    """
+    Pick the globally largest nodes for the Plotly treemap in one best-first pass
     
-    pruned = prune_node(pruned)
-    
-    # Check approximate size
-    try:
-        json_size = len(json.dumps(pruned)) / (1024 * 1024)  # Size in MB
-        print(f"Treemap data size: {json_size:.2f} MB")
-        
-        # If still too large, be more aggressive
-        if json_size > max_size_mb:
-            print("Data still too large, applying aggressive pruning...")
-            def aggressive_prune(node, depth=0):
-                if depth > 4:
-                    node["children"] = []
-                else:
-                    children = node.get("children", [])
-                    if children:
-                        max_children = max(15 - depth * 2, 5)
-                        node["children"] = children[:max_children]
-                        for child in node["children"]:
-                            aggressive_prune(child, depth + 1)
-                return node
-            pruned = aggressive_prune(pruned)
-    except:
-        pass  # If size check fails, proceed anyway
-    
-    return pruned
-
-def convert_to_treemap_format(data, max_nodes=300):
-    """Convert scan results to Plotly treemap format with size limits"""
+    Nodes come off a max-heap by size and their children are queued as they
+    are emitted, so every parent precedes its children and the work done is
+    proportional to the budget rather than the tree. The source tree is
+    never copied or modified.
+    """
     labels = []
     parents = []
     values = []
     ids = []
-    node_count = 0
+    payload_bytes = 0
+    counter = 0  # Tie-breaker so equal sizes never compare node dicts
     
-    def add_node(node, parent_id="", depth=0):
-        nonlocal node_count
-        
-        # Limit total nodes to prevent browser freeze
-        if node_count >= max_nodes:
-            return
-            
-        # Limit depth to prevent too much nesting
-        if depth > 8:
-            return
-            
+    pending = [(-data['size'], counter, data, "")]
+    while pending and len(ids) < max_nodes:
+        _, _, node, parent_id = heapq.heappop(pending)
         node_id = f"{parent_id}/{node['name']}" if parent_id else node['name']
         
+        # Rough JSON cost of this node across the four arrays
+        node_bytes = len(node['name']) + len(node_id) + len(parent_id) + len(str(node['size'])) + 16
+        if max_bytes is not None and payload_bytes + node_bytes > max_bytes:
+            break
+        payload_bytes += node_bytes
+        
         labels.append(node['name'])
         parents.append(parent_id)
         values.append(node['size'])
         ids.append(node_id)
-        node_count += 1
         
-        # Sort children by size and only add the largest ones
-        children = node.get('children', [])
-        if children:
-            children.sort(key=lambda x: x['size'], reverse=True)
-            # Limit children based on depth - fewer children at deeper levels
-            max_children = max(20 - depth * 2, 5)
-            for child in children[:max_children]:
-                if node_count >= max_nodes:
-                    break
-                add_node(child, node_id, depth + 1)
-    
-    add_node(data)
+        for child in node.get('children', []):
+            counter += 1
+            heapq.heappush(pending, (-child['size'], counter, child, node_id))
     
-    print(f"Generated treemap with {node_count} nodes")
+    print(f"Generated treemap with {len(ids)} nodes (~{payload_bytes / 1024:.0f} KB)")
     
     return {
         "labels": labels,
         "parents": parents,
         "values": values,
         "ids": ids,
-        "node_count": node_count
+        "node_count": len(ids)
     }
 
 @app.route('/discover_paths')
@@ -411,6 +665,99 @@ def format_size(size_bytes):
     
     return f"{size:.1f} {units[unit_index]}"
 
+def get_scan_history():
+    """Open the history database on first use"""
+    global scan_history
+    if scan_history is None:
+        scan_history = ScanHistory(history_db_path)
+    return scan_history
+
+@app.route('/schedule', methods=['GET'])
+def get_schedule():
+    """Get scheduled scan status"""
+    if scan_scheduler is None:
+        return jsonify({"running": False})
+    return jsonify(scan_scheduler.status())
+
+@app.route('/schedule', methods=['POST'])
+def start_schedule():
+    """Start (or replace) periodic scans that record directory size history"""
+    global scan_scheduler
+    
+    data = request.get_json(silent=True) or {}
+    paths = data.get('paths', [])
+    if isinstance(paths, str):
+        paths = [paths]
+    if not paths:
+        return jsonify({"error": "No paths to schedule"}), 400
+    
+    try:
+        interval = max(int(data.get('interval_minutes', 60)), 1) * 60
+        depth = max(int(data.get('depth', 3)), 0)
+    except (TypeError, ValueError):
+        return jsonify({"error": "interval_minutes and depth must be integers"}), 400
+    
+    try:
+        history = get_scan_history()
+    except (OSError, sqlite3.Error) as e:
+        return jsonify({"error": f"Cannot open history database: {e}"}), 500
+    
+    if scan_scheduler is not None:
+        scan_scheduler.stop()
+    scan_scheduler = ScanScheduler(history, paths, interval=interval, depth=depth,
+                                   exclude_dirs=data.get('exclude_dirs', []))
+    scan_scheduler.start()
+    
+    return jsonify(scan_scheduler.status())
+
+@app.route('/schedule/stop', methods=['POST'])
+def stop_schedule():
+    """Stop periodic scans"""
+    if scan_scheduler is not None:
+        scan_scheduler.stop()
+    return jsonify({"running": False})
+
+@app.route('/history')
+def get_history():
+    """Get the size growth curve of a directory from scheduled scans"""
+    path = request.args.get('path')
+    if not path:
+        return jsonify({"error": "No path given"}), 400
+    since = request.args.get('since', type=int)
+    
+    try:
+        growth = get_scan_history().get_growth(os.path.abspath(path), since)
+    except (OSError, sqlite3.Error) as e:
+        return jsonify({"error": f"Cannot read history database: {e}"}), 500
+    
+    if not growth["points"]:
+        return jsonify({"error": f"No history for path: {path}"}), 404
+    growth["change_formatted"] = format_size(abs(growth["change"]))
+    return jsonify(growth)
+
+def parse_size(value):
+    """Parse a byte count such as 5368709120, 5GB or 1.5 TB"""
+    if value is None or value == '':
+        return None
+    
+    units = {'B': 1, 'KB': 1024, 'MB': 1024**2, 'GB': 1024**3, 'TB': 1024**4}
+    text = value.strip().upper().replace(' ', '')
+    for unit in ('TB', 'GB', 'MB', 'KB', 'B'):
+        if text.endswith(unit):
+            number = text[:-len(unit)]
+            break
+    else:
+        unit, number = 'B', text
+    
+    try:
+        size = int(float(number) * units[unit])
+    except (ValueError, OverflowError):
+        # OverflowError: "inf" parses as a float but has no integer value
+        raise ValueError(f"Invalid size: {value}")
+    if size < 0:
+        raise ValueError(f"Size must not be negative: {value}")
+    return size
+
 if __name__ == '__main__':
     import sys
     import socket
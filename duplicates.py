@@ -0,0 +1,185 @@
+"""
+Duplicate File Finder Module
+Finds duplicate files in scan results using staged size/partial/full hashing
+"""
+
+import mmap
+import time
+import hashlib
+import threading
+from collections import defaultdict
+from concurrent.futures import ThreadPoolExecutor
+
+
+class DuplicateFinder:
+    def __init__(self, block_size=64 * 1024, chunk_size=1024 * 1024, max_workers=4, min_size=1):
+        """Initialize finder with hashing block sizes and thread pool width"""
+        # Bytes read from each end of a file for the partial hash
+        self.block_size = block_size
+        # Read size used when hashing whole files
+        self.chunk_size = chunk_size
+        self.max_workers = max_workers
+        # Empty files are all "identical" but reclaim nothing, so skip them
+        self.min_size = max(min_size, 1)
+        self.stats = {}
+        self._stats_lock = threading.Lock()
+
+    def find_duplicates(self, file_index, progress_callback=None):
+        """
+        Find sets of identical files
+
+        Args:
+            file_index: Iterable of file records with "path", "size", "dev" and "ino"
+                        keys, as collected by StorageScanner(track_files=True)
+            progress_callback: Optional callback(stage, processed, total); returning
+                               False stops the search
+
+        Returns:
+            List of duplicate sets, largest wasted bytes first
+        """
+        start_time = time.time()
+        self.stats = {
+            "files_considered": 0,
+            "size_groups": 0,
+            "partial_hashed": 0,
+            "full_hashed": 0,
+            "bytes_read": 0,
+            "elapsed": 0.0,
+            "throughput": 0.0,
+            "cancelled": False
+        }
+
+        # Stage 1: group by size, collapsing hardlinks to a single inode
+        by_size = defaultdict(dict)
+        for record in file_index:
+            if record["size"] < self.min_size:
+                continue
+            inode_key = (record["dev"], record["ino"])
+            # Hardlinks share storage, so they are never reclaimable duplicates
+            by_size[record["size"]].setdefault(inode_key, record)
+            self.stats["files_considered"] += 1
+
+        candidates = [list(group.values()) for group in by_size.values() if len(group) > 1]
+        self.stats["size_groups"] = len(candidates)
+        print(f"Duplicate search: {len(candidates)} size groups from {self.stats['files_considered']} files")
+
+        # Stage 2: hash the first and last blocks
+        candidates = self._refine(candidates, self._partial_hash, "partial", progress_callback)
+
+        # Stage 3: full hash, only where the partial hash didn't already cover the file
+        needs_full = [group for group in candidates if group[0]["size"] > 2 * self.block_size]
+        complete = [group for group in candidates if group[0]["size"] <= 2 * self.block_size]
+        if not self.stats["cancelled"]:
+            complete.extend(self._refine(needs_full, self._full_hash, "full", progress_callback))
+
+        duplicate_sets = []
+        for group in complete:
+            size = group[0]["size"]
+            duplicate_sets.append({
+                "size": size,
+                "count": len(group),
+                "wasted_bytes": size * (len(group) - 1),
+                "paths": sorted(record["path"] for record in group)
+            })
+        duplicate_sets.sort(key=lambda x: x["wasted_bytes"], reverse=True)
+
+        elapsed = time.time() - start_time
+        self.stats["elapsed"] = elapsed
+        self.stats["throughput"] = self.stats["bytes_read"] / elapsed if elapsed > 0 else 0.0
+        print(f"Duplicate search complete: {len(duplicate_sets)} sets, "
+              f"read {self.format_size(self.stats['bytes_read'])} in {elapsed:.1f}s")
+
+        return duplicate_sets
+
+    def _refine(self, groups, hash_func, stage, progress_callback):
+        """Split each group by hash_func, keeping only sub-groups with matches"""
+        records = [record for group in groups for record in group]
+        total = len(records)
+        digests = {}
+        processed = 0
+
+        with ThreadPoolExecutor(max_workers=self.max_workers) as executor:
+            for record, digest in zip(records, executor.map(hash_func, records)):
+                processed += 1
+                self.stats[f"{stage}_hashed"] += 1
+                if digest is not None:
+                    digests[record["path"]] = digest
+                if progress_callback and progress_callback(stage, processed, total) is False:
+                    self.stats["cancelled"] = True
+                    executor.shutdown(wait=True, cancel_futures=True)
+                    break
+
+        refined = []
+        for group in groups:
+            by_digest = defaultdict(list)
+            for record in group:
+                digest = digests.get(record["path"])
+                if digest is not None:
+                    by_digest[digest].append(record)
+            refined.extend(matches for matches in by_digest.values() if len(matches) > 1)
+        return refined
+
+    def _partial_hash(self, record):
+        """Hash the first and last block of a file"""
+        try:
+            with open(record["path"], "rb") as f:
+                hasher = hashlib.blake2b(digest_size=16)
+                head = f.read(self.block_size)
+                hasher.update(head)
+                bytes_read = len(head)
+                if record["size"] > self.block_size:
+                    f.seek(max(record["size"] - self.block_size, self.block_size))
+                    tail = f.read(self.block_size)
+                    hasher.update(tail)
+                    bytes_read += len(tail)
+                self._add_bytes_read(bytes_read)
+                return hasher.digest()
+        except (OSError, PermissionError):
+            return None
+
+    def _full_hash(self, record):
+        """Hash a whole file, using mmap where possible and chunked reads otherwise"""
+        try:
+            with open(record["path"], "rb") as f:
+                hasher = hashlib.blake2b(digest_size=32)
+                try:
+                    with mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ) as mapped:
+                        view = memoryview(mapped)
+                        try:
+                            for offset in range(0, len(mapped), self.chunk_size):
+                                hasher.update(view[offset:offset + self.chunk_size])
+                        finally:
+                            view.release()
+                        self._add_bytes_read(len(mapped))
+                except (ValueError, OSError):
+                    # mmap unsupported for this file (e.g. some network filesystems)
+                    f.seek(0)
+                    while True:
+                        chunk = f.read(self.chunk_size)
+                        if not chunk:
+                            break
+                        hasher.update(chunk)
+                        self._add_bytes_read(len(chunk))
+                return hasher.digest()
+        except (OSError, PermissionError):
+            return None
+
+    def _add_bytes_read(self, count):
+        """Record bytes read from worker threads"""
+        with self._stats_lock:
+            self.stats["bytes_read"] += count
+
+    def format_size(self, size_bytes):
+        """Format bytes as human-readable string"""
+        if size_bytes == 0:
+            return "0 B"
+
+        units = ['B', 'KB', 'MB', 'GB', 'TB']
+        unit_index = 0
+        size = float(size_bytes)
+
+        while size >= 1024 and unit_index < len(units) - 1:
+            size /= 1024
+            unit_index += 1
+
+        return f"{size:.1f} {units[unit_index]}"
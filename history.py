@@ -0,0 +1,219 @@
+"""
+Scan History Module
+Runs scans on a schedule and keeps per-directory sizes as downsampled time series
+"""
+
+import os
+import time
+import sqlite3
+import threading
+from contextlib import closing
+from scanner import StorageScanner
+
+# (bucket seconds, keep for seconds), finest first: hourly for a week, daily for a year
+DEFAULT_RETENTION = [
+    (3600, 7 * 86400),
+    (86400, 365 * 86400)
+]
+
+
+class ScanHistory:
+    def __init__(self, db_path, retention=None):
+        """Open (or create) a history database with a downsampling retention policy"""
+        self.db_path = db_path
+        self.retention = sorted(retention or DEFAULT_RETENTION)
+        # Each coarser bucket must be a whole number of finer ones to roll up cleanly
+        for (finer, _), (coarser, _) in zip(self.retention, self.retention[1:]):
+            if coarser % finer:
+                raise ValueError(f"Retention bucket {coarser}s is not a multiple of {finer}s")
+        self._lock = threading.Lock()
+
+        directory = os.path.dirname(db_path)
+        if directory:
+            os.makedirs(directory, exist_ok=True)
+        with closing(self._connect()) as conn:
+            conn.executescript("""
+                CREATE TABLE IF NOT EXISTS paths (
+                    id INTEGER PRIMARY KEY,
+                    path TEXT NOT NULL UNIQUE
+                );
+                CREATE TABLE IF NOT EXISTS samples (
+                    resolution INTEGER NOT NULL,
+                    path_id INTEGER NOT NULL,
+                    bucket INTEGER NOT NULL,
+                    size INTEGER NOT NULL,
+                    samples INTEGER NOT NULL,
+                    PRIMARY KEY (resolution, path_id, bucket)
+                ) WITHOUT ROWID;
+            """)
+            conn.commit()
+
+    def _connect(self):
+        return sqlite3.connect(self.db_path)
+
+    def record(self, scan_result, timestamp=None, depth=3):
+        """
+        Store the size of every directory in scan_result down to depth
+
+        Sizes go into the finest bucket, averaged with any earlier sample in
+        the same bucket. Old buckets are then rolled up per the retention policy.
+        """
+        if not scan_result:
+            return 0
+        timestamp = int(timestamp if timestamp is not None else time.time())
+        resolution = self.retention[0][0]
+        bucket = timestamp // resolution
+
+        rows = []
+        stack = [(scan_result, 0)]
+        while stack:
+            node, node_depth = stack.pop()
+            if node.get("is_file") or node.get("is_summary"):
+                continue
+            rows.append((node["path"], node["size"]))
+            if node_depth < depth:
+                stack.extend((child, node_depth + 1) for child in node.get("children", []))
+
+        with self._lock, closing(self._connect()) as conn:
+            conn.executemany("INSERT OR IGNORE INTO paths (path) VALUES (?)", [(path,) for path, _ in rows])
+            conn.executemany("""
+                INSERT INTO samples (resolution, path_id, bucket, size, samples)
+                SELECT ?, id, ?, ?, 1 FROM paths WHERE path = ?
+                ON CONFLICT (resolution, path_id, bucket) DO UPDATE SET
+                    size = (size * samples + excluded.size) / (samples + 1),
+                    samples = samples + 1
+            """, [(resolution, bucket, size, path) for path, size in rows])
+            self._apply_retention(conn, timestamp)
+            conn.commit()
+
+        return len(rows)
+
+    def _apply_retention(self, conn, now):
+        """Roll buckets older than their retention into the next coarser level, or drop them"""
+        for level, (resolution, keep) in enumerate(self.retention):
+            cutoff_bucket = (now - keep) // resolution
+            if level + 1 < len(self.retention):
+                coarser = self.retention[level + 1][0]
+                ratio = coarser // resolution
+                # Sample-weighted average keeps repeated partial roll-ups of one bucket exact
+                conn.execute("""
+                    INSERT INTO samples (resolution, path_id, bucket, size, samples)
+                    SELECT ?, path_id, bucket / ?, SUM(size * samples) / SUM(samples), SUM(samples)
+                    FROM samples WHERE resolution = ? AND bucket < ?
+                    GROUP BY path_id, bucket / ?
+                    ON CONFLICT (resolution, path_id, bucket) DO UPDATE SET
+                        size = (size * samples + excluded.size * excluded.samples) / (samples + excluded.samples),
+                        samples = samples + excluded.samples
+                """, (coarser, ratio, resolution, cutoff_bucket, ratio))
+            conn.execute("DELETE FROM samples WHERE resolution = ? AND bucket < ?", (resolution, cutoff_bucket))
+        conn.execute("DELETE FROM paths WHERE id NOT IN (SELECT DISTINCT path_id FROM samples)")
+
+    def get_series(self, path, since=None):
+        """
+        Return the size history of path, oldest first
+
+        Finer resolutions win where levels overlap, so recent history is
+        hourly and older history daily under the default policy.
+        """
+        path = path.rstrip('/') or '/'
+        with closing(self._connect()) as conn:
+            row = conn.execute("SELECT id FROM paths WHERE path = ?", (path,)).fetchone()
+            if row is None:
+                return []
+            rows = conn.execute(
+                "SELECT resolution, bucket, size FROM samples WHERE path_id = ? ORDER BY resolution",
+                (row[0],)).fetchall()
+
+        points = []
+        covered_from = None  # Start of the range already covered by a finer level
+        for resolution in sorted({r[0] for r in rows}):
+            level = [(bucket * resolution, size) for res, bucket, size in rows if res == resolution]
+            level_start = min(t for t, _ in level)
+            points.extend((t, size, resolution) for t, size in level
+                          if covered_from is None or t < covered_from)
+            covered_from = level_start if covered_from is None else min(covered_from, level_start)
+
+        points.sort()
+        return [{"timestamp": t, "size": size, "resolution": resolution}
+                for t, size, resolution in points if since is None or t >= since]
+
+    def get_growth(self, path, since=None):
+        """Summarise a path's series as a growth curve with total and per-day change"""
+        series = self.get_series(path, since)
+        growth = {"path": path, "points": series, "change": 0, "change_per_day": 0.0}
+        if len(series) >= 2:
+            change = series[-1]["size"] - series[0]["size"]
+            days = (series[-1]["timestamp"] - series[0]["timestamp"]) / 86400
+            growth["change"] = change
+            growth["change_per_day"] = change / days if days > 0 else 0.0
+        return growth
+
+
+class ScanScheduler:
+    def __init__(self, history, paths, interval=3600, depth=3, exclude_dirs=None, metadata_timeout=10):
+        """Periodically scan paths and record their directory sizes into history"""
+        self.history = history
+        # A hung network mount must not stall the schedule forever
+        self.metadata_timeout = metadata_timeout
+        self.paths = list(paths)
+        self.interval = interval
+        self.depth = depth
+        self.exclude_dirs = exclude_dirs or []
+        self.last_run = None
+        self.last_error = None
+        self.runs = 0
+        self._stop_event = threading.Event()
+        self._thread = None
+
+    def start(self):
+        """Start the scheduler thread; the first scan runs immediately"""
+        self._stop_event.clear()
+        self._thread = threading.Thread(target=self._run, daemon=True)
+        self._thread.start()
+
+    def stop(self):
+        """Stop the scheduler, abandoning any in-progress scan without recording it"""
+        self._stop_event.set()
+
+    def is_running(self):
+        return self._thread is not None and self._thread.is_alive() and not self._stop_event.is_set()
+
+    def run_once(self):
+        """Scan every configured path once and record the results"""
+        for path in self.paths:
+            if self._stop_event.is_set():
+                break
+            # Only nodes down to the history depth are needed, but totals must stay exact
+            scanner = StorageScanner(self.exclude_dirs, max_depth=self.depth, aggregate_below_depth=True,
+                                     metadata_timeout=self.metadata_timeout)
+            try:
+                # Lets stop() end a running scan, so a replacement schedule never overlaps it
+                result = scanner.scan_directory(path, lambda *_: not self._stop_event.is_set())
+                if scanner.stopped:
+                    print(f"Scheduled scan of {path} stopped; nothing recorded")
+                    break
+                recorded = self.history.record(result, depth=self.depth)
+                print(f"Scheduled scan of {path}: recorded {recorded} directories")
+                self.last_error = None
+            except Exception as e:
+                print(f"Scheduled scan error for {path}: {str(e)}")
+                self.last_error = str(e)
+        self.last_run = time.time()
+        self.runs += 1
+
+    def _run(self):
+        while not self._stop_event.is_set():
+            self.run_once()
+            self._stop_event.wait(self.interval)
+
+    def status(self):
+        return {
+            "running": self.is_running(),
+            "paths": self.paths,
+            "interval": self.interval,
+            "depth": self.depth,
+            "runs": self.runs,
+            "last_run": self.last_run,
+            "next_run": self.last_run + self.interval if self.last_run and self.is_running() else None,
+            "last_error": self.last_error
+        }
@@ -0,0 +1,171 @@
+"""
+Scan Index Module
+Indexes a scan result once so size, path and name queries don't walk the tree
+"""
+
+import os
+import bisect
+import fnmatch
+import itertools
+import re
+
+
+def pattern_extension(pattern):
+    """Return the extension for patterns like "*.log", which an extension index can answer"""
+    if pattern.startswith('*.') and not any(ch in pattern[2:] for ch in '*?[/.'):
+        return pattern[1:].lower()
+    return None
+
+
+class ScanIndex:
+    def __init__(self, scan_result):
+        """Flatten a scan result and build size, path-prefix and name/extension indexes"""
+        self.source = scan_result
+        self.paths = []
+        self.names = []
+        self.sizes = []
+        self.is_file = []
+        self.file_counts = []
+        self.dir_counts = []
+
+        stack = [scan_result] if scan_result else []
+        while stack:
+            node = stack.pop()
+            # Summary nodes aggregate several real entries, so they can't match a query
+            if not node.get("is_summary"):
+                self.paths.append(node["path"])
+                self.names.append(node["name"])
+                self.sizes.append(node["size"])
+                self.is_file.append(bool(node.get("is_file")))
+                self.file_counts.append(node.get("file_count", 0))
+                self.dir_counts.append(node.get("dir_count", 0))
+            stack.extend(node.get("children", []))
+
+        # Size index: ids largest first, with negated sizes ascending for bisect
+        self.by_size = sorted(range(len(self.sizes)), key=lambda i: self.sizes[i], reverse=True)
+        self.rank = [0] * len(self.by_size)
+        for position, node_id in enumerate(self.by_size):
+            self.rank[node_id] = position
+        self._neg_sizes = [-self.sizes[i] for i in self.by_size]
+
+        # Path-prefix index: ids in lexicographic path order
+        self.by_path = sorted(range(len(self.paths)), key=lambda i: self.paths[i])
+        self._sorted_paths = [self.paths[i] for i in self.by_path]
+
+        # Name/extension index: lowercase extension -> ids, largest first
+        self.by_extension = {}
+        for node_id in self.by_size:
+            extension = os.path.splitext(self.names[node_id])[1].lower()
+            self.by_extension.setdefault(extension, []).append(node_id)
+
+    def __len__(self):
+        return len(self.paths)
+
+    def query(self, min_size=None, max_size=None, prefix=None, pattern=None, kind=None, offset=0, limit=100):
+        """
+        Find indexed entries matching every given filter, largest first
+
+        Args:
+            min_size, max_size: Inclusive size range in bytes
+            prefix: Only entries at or below this path
+            pattern: Case-insensitive shell pattern matched against the entry name.
+                Only "*.ext" patterns use an index; others test every candidate name
+            kind: "file" or "directory"
+            offset, limit: Pagination over the sorted matches
+
+        Returns:
+            Dictionary with the page of "results" and the "total" match count.
+            Filters the indexes can't answer stop at the first match past the
+            page, in which case "total" is a lower bound and "total_exact" is False.
+        """
+        if prefix:
+            prefix = prefix.rstrip('/') or '/'
+            if prefix == '/':
+                prefix = None  # Everything is at or below the root
+        end = offset + limit
+
+        # Size-ordered candidates: a slice of the size index or an extension list
+        ids, lo, hi = self.by_size, 0, len(self.by_size)
+        if min_size is not None or max_size is not None:
+            lo = 0 if max_size is None else bisect.bisect_left(self._neg_sizes, -max_size)
+            hi = len(self._neg_sizes) if min_size is None else bisect.bisect_right(self._neg_sizes, -min_size)
+            hi = max(hi, lo)  # min_size above max_size matches nothing
+        extension = pattern_extension(pattern) if pattern else None
+        if extension is not None:
+            extension_ids = self.by_extension.get(extension, [])
+            if len(extension_ids) < hi - lo:
+                ids, lo, hi = extension_ids, 0, len(extension_ids)
+
+        if ids is self.by_size and not (prefix or pattern or kind):
+            # The size range is the answer; page it without looking at each entry
+            return self._result(ids[min(lo + offset, hi):min(lo + end, hi)], hi - lo, True, offset, limit)
+
+        # Compiled once per query; matching a regex is much cheaper than fnmatch per name
+        pattern = re.compile(fnmatch.translate(pattern), re.IGNORECASE).match if pattern else None
+
+        if prefix:
+            # Paths below prefix sort between "prefix/" and "prefix0" ('0' follows '/')
+            path_lo = bisect.bisect_left(self._sorted_paths, prefix)
+            path_hi = bisect.bisect_left(self._sorted_paths, prefix + '0')
+            # Filtering the whole prefix range costs its length, while walking in
+            # size order costs about end * candidates / matches; take the cheaper
+            if (path_hi - path_lo) ** 2 <= end * (hi - lo):
+                matches = [i for i in itertools.islice(self.by_path, path_lo, path_hi)
+                           if self._matches(i, min_size, max_size, prefix, pattern, kind)]
+                matches.sort(key=self.rank.__getitem__)
+                return self._result(matches[offset:end], len(matches), True, offset, limit)
+
+        # Walk in size order and stop at the first match past the page
+        candidates = itertools.islice(ids, lo, hi)
+        if pattern:
+            # Name test inlined, as it is the one that has to touch every candidate
+            names = self.names
+            candidates = (i for i in candidates if pattern(names[i]))
+        page = []
+        total = 0
+        for node_id in candidates:
+            if not self._matches(node_id, min_size, max_size, prefix, None, kind):
+                continue
+            total += 1
+            if total > end:
+                return self._result(page, total, False, offset, limit)
+            if total > offset:
+                page.append(node_id)
+        return self._result(page, total, True, offset, limit)
+
+    def _result(self, page, total, total_exact, offset, limit):
+        return {
+            "total": total,
+            "total_exact": total_exact,
+            "offset": offset,
+            "limit": limit,
+            "results": [self._entry(i) for i in page]
+        }
+
+    def _matches(self, node_id, min_size, max_size, prefix, pattern, kind):
+        size = self.sizes[node_id]
+        if min_size is not None and size < min_size:
+            return False
+        if max_size is not None and size > max_size:
+            return False
+        if prefix and prefix != '/':
+            path = self.paths[node_id]
+            if path != prefix and not path.startswith(prefix + '/'):
+                return False
+        if kind == "file" and not self.is_file[node_id]:
+            return False
+        if kind == "directory" and self.is_file[node_id]:
+            return False
+        if pattern and not pattern(self.names[node_id]):
+            return False
+        return True
+
+    def _entry(self, node_id):
+        return {
+            "path": self.paths[node_id],
+            "name": self.names[node_id],
+            "size": self.sizes[node_id],
+            "is_file": self.is_file[node_id],
+            "file_count": self.file_counts[node_id],
+            "dir_count": self.dir_counts[node_id]
+        }
@@ -0,0 +1,448 @@
+"""
+Scan Store Module
+Keeps scan records in an on-disk SQLite database instead of in memory
+"""
+
+import os
+import re
+import atexit
+import heapq
+import fnmatch
+import sqlite3
+import tempfile
+import threading
+from contextlib import contextmanager
+from scan_index import pattern_extension
+
+# Temporary databases still on disk, removed at exit if nothing closed them first
+_temporary_databases = set()
+
+
+@atexit.register
+def _remove_temporary_databases():
+    for db_path in list(_temporary_databases):
+        _remove_database(db_path)
+
+
+def _remove_database(db_path):
+    _temporary_databases.discard(db_path)
+    for suffix in ("", "-wal", "-shm"):
+        try:
+            os.remove(db_path + suffix)
+        except OSError:
+            pass
+
+
+class ScanStore:
+    def __init__(self, db_path=None, batch_size=5000):
+        """Open (or create) a store; a temporary database is used if no path is given"""
+        self.owns_file = db_path is None
+        if db_path is None:
+            fd, db_path = tempfile.mkstemp(prefix="vizdisk-", suffix=".sqlite")
+            os.close(fd)
+            _temporary_databases.add(db_path)
+        self.db_path = db_path
+        self.batch_size = batch_size
+        self.root_path = None
+        self.partial = False
+        self.finalized = False
+        self._pending_dirs = []
+        self._pending_files = []
+        # Readers and the scan writing into it hold the database open;
+        # close() waits for the last holder before deleting it
+        self._holders = 0
+        self._close_requested = False
+        self._holders_lock = threading.Lock()
+
+        # The writer connection is only used by the scanning thread
+        self._conn = sqlite3.connect(db_path, check_same_thread=False)
+        self._conn.execute("PRAGMA journal_mode=WAL")
+        self._conn.execute("PRAGMA synchronous=OFF")
+        # Cap SQLite's page cache so memory stays bounded (negative = KiB)
+        self._conn.execute("PRAGMA cache_size=-65536")
+        self._conn.executescript("""
+            DROP TABLE IF EXISTS dirs;
+            DROP TABLE IF EXISTS files;
+            DROP TABLE IF EXISTS inodes;
+            CREATE TABLE dirs (
+                id INTEGER PRIMARY KEY,
+                parent_id INTEGER,
+                depth INTEGER NOT NULL,
+                path TEXT NOT NULL,
+                name TEXT NOT NULL,
+                extension TEXT NOT NULL,
+                direct_size INTEGER NOT NULL,
+                size INTEGER NOT NULL DEFAULT 0,
+                file_count INTEGER NOT NULL,
+                dir_count INTEGER NOT NULL DEFAULT 0
+            );
+            CREATE TABLE files (
+                dir_id INTEGER NOT NULL,
+                path TEXT NOT NULL,
+                name TEXT NOT NULL,
+                extension TEXT NOT NULL,
+                size INTEGER NOT NULL,
+                dev INTEGER NOT NULL,
+                ino INTEGER NOT NULL
+            );
+            CREATE TABLE inodes (
+                dev INTEGER NOT NULL,
+                ino INTEGER NOT NULL,
+                PRIMARY KEY (dev, ino)
+            ) WITHOUT ROWID;
+        """)
+        self._conn.commit()
+
+    def add_directory(self, dir_id, parent_id, depth, path, direct_size, file_count):
+        """Queue a directory record; written in batches"""
+        name = os.path.basename(path) or path
+        self._pending_dirs.append((dir_id, parent_id, depth, path, name, self._extension(name),
+                                   direct_size, file_count))
+        if len(self._pending_dirs) >= self.batch_size:
+            self.flush()
+
+    def add_file(self, dir_id, path, size, dev, ino):
+        """Queue a file record; written in batches"""
+        name = os.path.basename(path)
+        self._pending_files.append((dir_id, path, name, self._extension(name), size, dev, ino))
+        if len(self._pending_files) >= self.batch_size:
+            self.flush()
+
+    def seen_inode(self, dev, ino):
+        """Record a hardlinked inode, returning True if it was already counted"""
+        cursor = self._conn.execute("INSERT OR IGNORE INTO inodes (dev, ino) VALUES (?, ?)", (dev, ino))
+        return cursor.rowcount == 0
+
+    def flush(self):
+        """Write queued records in a single transaction"""
+        if self._pending_dirs:
+            self._conn.executemany(
+                "INSERT INTO dirs (id, parent_id, depth, path, name, extension, direct_size, file_count) "
+                "VALUES (?, ?, ?, ?, ?, ?, ?, ?)", self._pending_dirs)
+            self._pending_dirs = []
+        if self._pending_files:
+            self._conn.executemany(
+                "INSERT INTO files (dir_id, path, name, extension, size, dev, ino) VALUES (?, ?, ?, ?, ?, ?, ?)",
+                self._pending_files)
+            self._pending_files = []
+        self._conn.commit()
+
+    def finalize(self):
+        """Index the records and compute subtree sizes bottom-up, one depth level at a time"""
+        self.flush()
+        self._conn.executescript("""
+            CREATE INDEX IF NOT EXISTS dirs_parent ON dirs (parent_id, size);
+            CREATE INDEX IF NOT EXISTS dirs_depth ON dirs (depth);
+            CREATE INDEX IF NOT EXISTS dirs_size ON dirs (size);
+            CREATE UNIQUE INDEX IF NOT EXISTS dirs_path ON dirs (path);
+            CREATE INDEX IF NOT EXISTS dirs_extension ON dirs (extension, size);
+            CREATE INDEX IF NOT EXISTS files_dir ON files (dir_id, size);
+            CREATE INDEX IF NOT EXISTS files_size ON files (size);
+            CREATE INDEX IF NOT EXISTS files_path ON files (path);
+            CREATE INDEX IF NOT EXISTS files_extension ON files (extension, size);
+        """)
+
+        max_depth = self._conn.execute("SELECT MAX(depth) FROM dirs").fetchone()[0]
+        if max_depth is not None:
+            for depth in range(max_depth, -1, -1):
+                # Children at depth + 1 are already final when their parents are summed
+                self._conn.execute("""
+                    UPDATE dirs SET
+                        size = direct_size + COALESCE(
+                            (SELECT SUM(c.size) FROM dirs c WHERE c.parent_id = dirs.id), 0),
+                        dir_count = (SELECT COUNT(*) FROM dirs c WHERE c.parent_id = dirs.id)
+                    WHERE depth = ?
+                """, (depth,))
+                self._conn.commit()
+
+        # Hardlink tracking is only needed while scanning
+        self._conn.execute("DELETE FROM inodes")
+        self._conn.commit()
+        self.finalized = True
+        return self.get_summary()
+
+    @contextmanager
+    def _read(self):
+        """Open a connection for queries, so request threads don't share the writer"""
+        self._acquire()
+        try:
+            conn = sqlite3.connect(self.db_path)
+            try:
+                yield conn
+            finally:
+                conn.close()
+        finally:
+            self._unhold()
+
+    @contextmanager
+    def writing(self):
+        """Hold the store open while a scan writes into it"""
+        self._acquire()
+        try:
+            yield self
+        finally:
+            self._unhold()
+
+    @property
+    def closed(self):
+        """True once close() was called; a scan still writing should stop"""
+        return self._close_requested
+
+    def _acquire(self):
+        with self._holders_lock:
+            if self._close_requested:
+                raise sqlite3.ProgrammingError("Scan store is closed")
+            self._holders += 1
+
+    def _unhold(self):
+        with self._holders_lock:
+            self._holders -= 1
+            release = self._close_requested and self._holders == 0
+        if release:
+            self._release()
+
+    def get_summary(self):
+        """Return totals for the scan root"""
+        with self._read() as conn:
+            row = conn.execute(
+                "SELECT path, name, size, file_count, dir_count FROM dirs WHERE parent_id IS NULL"
+            ).fetchone()
+            counts = conn.execute("SELECT COUNT(*), SUM(file_count) FROM dirs").fetchone()
+        if row is None:
+            return None
+        return {
+            "path": row[0],
+            "name": row[1],
+            "size": row[2],
+            "file_count": row[3],
+            "dir_count": row[4],
+            "total_dirs": counts[0],
+            "total_files": counts[1] or 0,
+            "partial": self.partial
+        }
+
+    def children(self, path, limit=50, offset=0):
+        """Return the directories and stored files directly under path, largest first"""
+        with self._read() as conn:
+            row = conn.execute("SELECT id FROM dirs WHERE path = ?", (path,)).fetchone()
+            if row is None:
+                return None
+            rows = conn.execute("""
+                SELECT name, path, size, file_count, dir_count, 0 FROM dirs WHERE parent_id = ?
+                UNION ALL
+                SELECT name, path, size, 1, 0, 1 FROM files WHERE dir_id = ?
+                ORDER BY 3 DESC LIMIT ? OFFSET ?
+            """, (row[0], row[0], limit, offset)).fetchall()
+        return [self._row_to_node(r) for r in rows]
+
+    def load_tree(self, max_nodes=5000, max_children=50, min_file_size=1024 * 1024):
+        """
+        Build a bounded in-memory tree in the StorageScanner result format
+
+        Directories are expanded largest first until max_nodes nodes have been
+        loaded, so the result size depends on max_nodes rather than on the
+        number of records in the store.
+        """
+        with self._read() as conn:
+            row = conn.execute(
+                "SELECT id, name, path, size, file_count, dir_count FROM dirs WHERE parent_id IS NULL"
+            ).fetchone()
+            if row is None:
+                return None
+
+            root = self._dir_row_to_node(row[1:])
+            node_count = 1
+            counter = 0
+            pending = [(-root["size"], counter, row[0], root)]
+
+            while pending and node_count < max_nodes:
+                _, _, dir_id, node = heapq.heappop(pending)
+                rows = conn.execute("""
+                    SELECT id, name, path, size, file_count, dir_count, 0 FROM dirs WHERE parent_id = ?
+                    UNION ALL
+                    SELECT NULL, name, path, size, 1, 0, 1 FROM files WHERE dir_id = ? AND size > ?
+                    ORDER BY 4 DESC LIMIT ?
+                """, (dir_id, dir_id, min_file_size, max_children + 1)).fetchall()
+
+                kept = rows[:max_children]
+                for child_row in kept:
+                    if node_count >= max_nodes:
+                        break
+                    if child_row[6]:
+                        child = self._row_to_node((child_row[1], child_row[2], child_row[3], 1, 0, 1))
+                    else:
+                        child = self._dir_row_to_node(child_row[1:6])
+                        counter += 1
+                        heapq.heappush(pending, (-child["size"], counter, child_row[0], child))
+                    node["children"].append(child)
+                    node_count += 1
+
+                remaining_size = node["size"] - sum(child["size"] for child in node["children"])
+                if len(rows) > max_children and remaining_size > 0:
+                    node["children"].append({
+                        "name": "... other items",
+                        "path": f"{node['path']}/...",
+                        "size": remaining_size,
+                        "children": [],
+                        "file_count": 0,
+                        "dir_count": 0,
+                        "is_summary": True
+                    })
+                    node_count += 1
+
+        if self.partial:
+            root["partial"] = True
+        return root
+
+    def query(self, min_size=None, max_size=None, prefix=None, pattern=None, kind=None, offset=0, limit=100):
+        """
+        Find stored entries matching every given filter, largest first (same API as ScanIndex.query)
+
+        Only one row past the page is fetched, so "total" is a lower bound
+        ("total_exact" False) whenever more matches exist than the page shows.
+        Patterns other than "*.ext" can't use the extension index and scan
+        every name left by the size and prefix conditions.
+        """
+        conditions = []
+        params = []
+        if min_size is not None:
+            conditions.append("size >= ?")
+            params.append(min_size)
+        if max_size is not None:
+            conditions.append("size <= ?")
+            params.append(max_size)
+        if prefix:
+            prefix = prefix.rstrip('/') or '/'
+            if prefix != '/':
+                # Range form so the path index can be used ('0' sorts right after '/')
+                conditions.append("(path = ? OR (path >= ? AND path < ?))")
+                params.extend([prefix, prefix + '/', prefix + '0'])
+        if pattern:
+            extension = pattern_extension(pattern)
+            if extension is not None:
+                # Narrow with the extension index; names like ".log" still need the full match
+                conditions.append("extension = ?")
+                params.append(extension)
+            conditions.append("name_matches(name)")
+        where = " AND ".join(conditions) or "1"
+
+        selects = []
+        select_params = []
+        if kind != "file":
+            selects.append(f"SELECT path, name, size, 0 AS is_file, file_count, dir_count FROM dirs WHERE {where}")
+            select_params.extend(params)
+        if kind != "directory":
+            selects.append(f"SELECT path, name, size, 1 AS is_file, 1, 0 FROM files WHERE {where}")
+            select_params.extend(params)
+        union = " UNION ALL ".join(selects)
+
+        with self._read() as conn:
+            if pattern:
+                match = re.compile(fnmatch.translate(pattern), re.IGNORECASE).match
+                conn.create_function("name_matches", 1, lambda name: match(name) is not None,
+                                     deterministic=True)
+            rows = conn.execute(f"{union} ORDER BY size DESC LIMIT ? OFFSET ?",
+                                select_params + [limit + 1, offset]).fetchall()
+            total_exact = len(rows) <= limit
+            if rows or offset == 0:
+                total = offset + len(rows)
+            else:
+                # Paged past the end, so the page says nothing about the total
+                total = conn.execute(f"SELECT COUNT(*) FROM ({union})", select_params).fetchone()[0]
+
+        return {
+            "total": total,
+            "total_exact": total_exact,
+            "offset": offset,
+            "limit": limit,
+            "results": [{"path": r[0], "name": r[1], "size": r[2], "is_file": bool(r[3]),
+                         "file_count": r[4], "dir_count": r[5]} for r in rows[:limit]]
+        }
+
+    def top_directories(self, limit=20):
+        """Get top directories by size"""
+        with self._read() as conn:
+            rows = conn.execute(
+                "SELECT path, name, size, file_count, dir_count FROM dirs ORDER BY size DESC LIMIT ?",
+                (limit,)).fetchall()
+        return [{"path": r[0], "name": r[1], "size": r[2], "file_count": r[3], "dir_count": r[4]}
+                for r in rows]
+
+    def top_files(self, limit=20):
+        """Get top files by size"""
+        with self._read() as conn:
+            rows = conn.execute("SELECT path, name, size FROM files ORDER BY size DESC LIMIT ?",
+                                (limit,)).fetchall()
+        return [{"path": r[0], "name": r[1], "size": r[2]} for r in rows]
+
+    def size_collisions(self, min_size=1):
+        """
+        Iterate file records whose size occurs more than once, smallest size first
+
+        Files with a unique size can't have duplicates, so SQLite drops them
+        and only candidate rows reach a DuplicateFinder.
+        """
+        with self._read() as conn:
+            cursor = conn.execute("""
+                SELECT path, size, dev, ino FROM files WHERE size IN (
+                    SELECT size FROM files WHERE size >= ? GROUP BY size HAVING COUNT(*) > 1
+                ) ORDER BY size
+            """, (min_size,))
+            while True:
+                rows = cursor.fetchmany(self.batch_size)
+                if not rows:
+                    break
+                for path, size, dev, ino in rows:
+                    yield {"path": path, "size": size, "dev": dev, "ino": ino}
+
+    def __iter__(self):
+        """Iterate stored file records, in the format DuplicateFinder expects"""
+        with self._read() as conn:
+            cursor = conn.execute("SELECT path, size, dev, ino FROM files")
+            while True:
+                rows = cursor.fetchmany(self.batch_size)
+                if not rows:
+                    break
+                for path, size, dev, ino in rows:
+                    yield {"path": path, "size": size, "dev": dev, "ino": ino}
+
+    def close(self):
+        """
+        Close the store, deleting the database if it was a temporary one
+        
+        New reads are refused at once; if a query, iteration or scan is
+        still using it, the database is released when the last one finishes.
+        """
+        with self._holders_lock:
+            if self._close_requested:
+                return
+            self._close_requested = True
+            release = self._holders == 0
+        if release:
+            self._release()
+    
+    def _release(self):
+        self._conn.close()
+        if self.owns_file:
+            _remove_database(self.db_path)
+
+    def _extension(self, name):
+        return os.path.splitext(name)[1].lower()
+
+    def _dir_row_to_node(self, row):
+        name, path, size, file_count, dir_count = row
+        return {
+            "name": name,
+            "path": path,
+            "size": size,
+            "children": [],
+            "file_count": file_count,
+            "dir_count": dir_count
+        }
+
+    def _row_to_node(self, row):
+        name, path, size, file_count, dir_count, is_file = row
+        node = self._dir_row_to_node((name, path, size, file_count, dir_count))
+        if is_file:
+            node["is_file"] = True
+        return node
@@ -4,13 +4,114 @@ Efficiently scans directories and calculates sizes
 """
 
 import os
+import math
 import stat
 import time
+import errno
+import heapq
+import queue
+import random
+import threading
 from pathlib import Path
 from collections import defaultdict
 
+# Filesystem types whose metadata calls can block for a long time or forever
+SLOW_FILESYSTEM_TYPES = {
+    'nfs', 'nfs4', 'cifs', 'smbfs', 'smb3', 'afpfs', 'webdav', 'davfs', 'sshfs', '9p',
+    'fuse', 'macfuse', 'osxfuse'
+}
+
+# Errors a network filesystem can return for a call that may succeed if repeated
+TRANSIENT_ERRNOS = {errno.EAGAIN, errno.EINTR, errno.EIO, errno.ETIMEDOUT}
+
+class MetadataTimeout(OSError):
+    """A filesystem metadata call didn't return within the allowed time"""
+
+class MetadataWorkerPool:
+    """
+    Daemon threads that run blocking metadata calls under a timeout
+    
+    A call that times out leaves its worker blocked inside the kernel, so the
+    watchdog writes that worker off and starts a replacement, keeping the
+    pool at full strength. A replaced worker exits if it ever returns. At
+    most max_hung replacements are outstanding at once, bounding the threads
+    dead mounts can pin; past that, stuck workers aren't replaced and rejoin
+    the pool when their call returns.
+    """
+    
+    def __init__(self, workers=4, max_hung=32):
+        self.workers = workers
+        self.max_hung = max_hung
+        self.hung = 0
+        self._tasks = queue.Queue()
+        self._lock = threading.Lock()
+        for _ in range(workers):
+            self._spawn()
+    
+    def _spawn(self):
+        worker = threading.Thread(target=self._worker, daemon=True)
+        worker.start()
+    
+    def _worker(self):
+        while True:
+            func, arg, box, done = self._tasks.get()
+            with self._lock:
+                if box.get("abandoned"):
+                    continue  # Caller already gave up before this task started
+                box["started"] = True
+            try:
+                box["result"] = func(arg)
+            except BaseException as e:
+                box["error"] = e
+            with self._lock:
+                done.set()
+                if box.get("replaced"):
+                    # Another worker took over while this one was stuck; retire it
+                    self.hung -= 1
+                    return
+    
+    def call(self, func, arg, timeout, retries=0):
+        """
+        Run func(arg) on a worker, raising MetadataTimeout if it doesn't return in time
+        
+        A timed-out call is never resubmitted, as its worker is still stuck on
+        the same path; retries only repeat calls that failed with a transient error.
+        """
+        for attempt in range(retries + 1):
+            box = {}
+            done = threading.Event()
+            self._tasks.put((func, arg, box, done))
+            done.wait(timeout)
+            with self._lock:
+                if not done.is_set():
+                    box["abandoned"] = True
+                    if box.get("started") and self.hung < self.max_hung:
+                        box["replaced"] = True
+                        self.hung += 1
+                        self._spawn()
+                    raise MetadataTimeout(errno.ETIMEDOUT, f"Timed out after {timeout}s", arg)
+            error = box.get("error")
+            if isinstance(error, OSError) and error.errno in TRANSIENT_ERRNOS and attempt < retries:
+                continue
+            if error is not None:
+                raise error
+            return box["result"]
+
+_metadata_pool = None
+_metadata_pool_lock = threading.Lock()
+
+def get_metadata_pool():
+    """Return the process-wide metadata worker pool, shared so scans don't leak idle workers"""
+    global _metadata_pool
+    with _metadata_pool_lock:
+        if _metadata_pool is None:
+            _metadata_pool = MetadataWorkerPool()
+        return _metadata_pool
+
 class StorageScanner:
-    def __init__(self, exclude_dirs=None, max_depth=None):
+    def __init__(self, exclude_dirs=None, max_depth=None, track_files=False, aggregate_below_depth=False,
+                 schedule="listdir", size_hints=None, metadata_timeout=None, metadata_retries=1,
+                 guard_all_filesystems=False):
         """Initialize scanner with optional directory exclusions and depth limit"""
         self.exclude_dirs = set(exclude_dirs or [])
         # Only exclude virtual filesystems and container-specific paths
@@ -31,9 +132,41 @@ class StorageScanner:
         self.start_filesystem = None
         # Set depth limit for performance (None = unlimited)
         self.max_depth = max_depth
+        # Keep totals exact past max_depth by summing deeper subtrees without building nodes
+        self.aggregate_below_depth = aggregate_below_depth
+        # Directory visiting order: "listdir" (depth-first, raw order) or "largest_first"
+        if schedule not in ("listdir", "largest_first"):
+            raise ValueError(f"Unknown scan schedule: {schedule}")
+        self.schedule = schedule
+        # Known directory sizes (e.g. from a previous scan) used to prioritise largest_first
+        self.size_hints = size_hints or {}
         # Add batch processing counter
         self.processed_count = 0
         self.batch_size = 100
+        # Optionally record every regular file for later analysis (e.g. duplicate search)
+        self.track_files = track_files
+        self.file_index = []
+        # Sampling parameters for preview scans
+        self.preview_sample_size = 50  # Files stat'ed per directory
+        self.preview_dir_sample = None  # Subdirectories descended into per directory (None = as time allows)
+        self.preview_fallback_sample = 3  # Subdirectories size-checked when time runs out before sampling any
+        self._random = random.Random()
+        # Timeout guard for hung network/FUSE mounts (None = call the filesystem directly)
+        self.metadata_timeout = metadata_timeout
+        self.metadata_retries = metadata_retries  # Repeats of calls failing with a transient error
+        self.guard_all_filesystems = guard_all_filesystems  # Guard local filesystems too
+        self._metadata_pool = None
+        self._guard_active = False
+        # Network/FUSE mount points from the mount table, read once per scan
+        self._slow_mounts = []
+        # Slow mount points below the scan root, skipped by path without being touched
+        self._skip_mounts = set()
+        # Every mount point, to tell a hung mount from a hung directory
+        self._mount_points = set()
+        # Paths whose metadata calls timed out; their subtrees are incomplete
+        self.incomplete_paths = []
+        # Set once progress_callback returns False
+        self.stopped = False
         
     def scan_directory(self, root_path, progress_callback=None):
         """
@@ -46,24 +179,14 @@ class StorageScanner:
         Returns:
             Dictionary with hierarchical directory structure and sizes
         """
-        root_path = os.path.abspath(root_path)
-        
-        if not os.path.exists(root_path):
-            raise ValueError(f"Path does not exist: {root_path}")
-            
-        if not os.path.isdir(root_path):
-            raise ValueError(f"Path is not a directory: {root_path}")
+        root_path = self._prepare_scan(root_path)
         
         # Reset tracking variables for this scan
         self.processed_inodes = set()
+        self.file_index = []
         
-        # Get the filesystem of the starting directory to avoid crossing mount points
-        try:
-            start_stat = os.lstat(root_path)
-            self.start_filesystem = start_stat.st_dev
+        if self.start_filesystem is not None:
             print(f"Starting scan on filesystem device: {self.start_filesystem}")
-        except (OSError, PermissionError):
-            self.start_filesystem = None
             
         print(f"Scanning: {root_path}")
         print(f"Excluded directories: {len(self.exclude_dirs)} patterns")
@@ -75,11 +198,16 @@ class StorageScanner:
         def update_progress(current_path):
             nonlocal processed_items
             processed_items += 1
-            if progress_callback:
-                progress_callback(current_path, processed_items, total_items)
+            if progress_callback and progress_callback(current_path, processed_items, total_items) is False:
+                self.stopped = True
+                return False
+            return True
         
-        # Scan the directory tree with depth 0 as starting point
-        result = self._scan_recursive(root_path, update_progress, depth=0)
+        if self.schedule == "largest_first":
+            result = self._scan_prioritized(root_path, update_progress)
+        else:
+            # Scan the directory tree with depth 0 as starting point
+            result = self._scan_recursive(root_path, update_progress, depth=0)
         
         # Validate results and log potential issues
         if result:
@@ -88,6 +216,9 @@ class StorageScanner:
             print(f"Total size: {self.format_size(result['size'])} ({total_size_gb:.1f} GB)")
             print(f"Files: {result['file_count']}, Directories: {result['dir_count']}")
             print(f"Processed inodes: {len(self.processed_inodes)}")
+            if self.incomplete_paths:
+                result["incomplete_paths"] = list(self.incomplete_paths)
+                print(f"WARNING: {len(self.incomplete_paths)} paths timed out and are incomplete")
             
             # Sanity check: warn if size seems unrealistic
             if total_size_gb > 2000:  # More than 2TB seems suspicious
@@ -96,6 +227,127 @@ class StorageScanner:
         
         return result
     
+    def _prepare_scan(self, root_path):
+        """Validate the scan root, set up the metadata guard and record its filesystem"""
+        root_path = os.path.abspath(root_path)
+        self.incomplete_paths = []
+        self.stopped = False
+        
+        # Decide on the guard before touching the root, which may itself be on a hung mount
+        mounts = self._read_mounts()
+        self._slow_mounts = [point for point, fs_type in mounts if self._is_slow_type(fs_type)]
+        self._skip_mounts = set()
+        self._mount_points = {point for point, _ in mounts}
+        self._guard_active = self.metadata_timeout is not None and (
+            self.guard_all_filesystems or self._is_slow_type(self._mount_type(root_path, mounts)))
+        if self.metadata_timeout is not None and (self._guard_active or self._slow_mounts):
+            self._metadata_pool = get_metadata_pool()
+            print(f"Guarding metadata calls with a {self.metadata_timeout}s timeout")
+        
+        try:
+            root_stat = self._metadata_call(os.stat, root_path)
+        except MetadataTimeout:
+            raise ValueError(f"Path is not responding: {root_path}")
+        except OSError:
+            raise ValueError(f"Path does not exist: {root_path}")
+        
+        if not stat.S_ISDIR(root_stat.st_mode):
+            raise ValueError(f"Path is not a directory: {root_path}")
+        
+        # Get the filesystem of the starting directory to avoid crossing mount points
+        try:
+            self.start_filesystem = self._lstat(root_path).st_dev
+        except (OSError, PermissionError):
+            self.start_filesystem = None
+        
+        if self.start_filesystem is not None:
+            # Slow mounts below the root are other filesystems the scan would skip anyway,
+            # but finding that out takes an lstat of the mount point, which can hang
+            self._skip_mounts = {point for point in self._slow_mounts
+                                 if point.startswith(root_path.rstrip('/') + '/')}
+        
+        return root_path
+    
+    def _metadata_call(self, func, path):
+        """Run a metadata call, under the timeout guard if the path may be on a slow mount"""
+        if self.metadata_timeout is None or not (self._guard_active or self._on_slow_mount(path)):
+            return func(path)
+        return self._metadata_pool.call(func, path, self.metadata_timeout, self.metadata_retries)
+    
+    def _on_slow_mount(self, path):
+        return any(path == point or path.startswith(point.rstrip('/') + '/') for point in self._slow_mounts)
+    
+    def _lstat(self, path):
+        if path in self._skip_mounts:
+            # Reported like any other unreadable entry, so every walker skips it
+            raise OSError(errno.EXDEV, "Slow filesystem mount point skipped", path)
+        return self._metadata_call(os.lstat, path)
+    
+    def _listdir(self, path):
+        return self._metadata_call(os.listdir, path)
+    
+    def _scandir_list(self, path):
+        with os.scandir(path) as iterator:
+            return list(iterator)
+    
+    def _mark_incomplete(self, node, path):
+        """Flag a node whose contents couldn't be read in time"""
+        print(f"Timed out reading: {path}")
+        self.incomplete_paths.append(path)
+        if node is not None:
+            node["incomplete"] = True
+    
+    def _abandon_directory(self, node, entry_path):
+        """
+        Record an entry whose metadata call timed out and say whether to stop reading its directory
+        
+        A mount point hangs on its own filesystem, but any other entry hangs on
+        its directory's, where every remaining entry would time out in turn.
+        """
+        self._mark_incomplete(node, entry_path)
+        return entry_path not in self._mount_points
+    
+    def _read_mounts(self):
+        """Return (mount point, filesystem type) pairs from the mount table"""
+        mounts = []
+        try:
+            with open('/proc/mounts') as f:
+                for line in f:
+                    fields = line.split()
+                    if len(fields) >= 3:
+                        mounts.append((fields[1].replace('\\040', ' '), fields[2]))
+        except OSError:
+            # macOS: "device on /mount/point (type, options...)"
+            try:
+                import subprocess
+                output = subprocess.run(['mount'], capture_output=True, text=True, timeout=5).stdout
+            except (OSError, subprocess.SubprocessError):
+                return mounts
+            for line in output.splitlines():
+                if ' on ' in line and ' (' in line:
+                    mount_point = line.split(' on ', 1)[1].rsplit(' (', 1)[0]
+                    fs_type = line.rsplit(' (', 1)[1].split(',')[0].rstrip(')')
+                    mounts.append((mount_point, fs_type))
+        return mounts
+    
+    def _mount_type(self, path, mounts=None):
+        """Return the filesystem type of the mount containing path, without touching the path"""
+        if mounts is None:
+            mounts = self._read_mounts()
+        best_point, best_type = '', None
+        for mount_point, fs_type in mounts:
+            inside = path == mount_point or path.startswith(mount_point.rstrip('/') + '/')
+            if inside and len(mount_point) >= len(best_point):
+                best_point, best_type = mount_point, fs_type
+        return best_type
+    
+    def _is_slow_type(self, fs_type):
+        """Check if a filesystem type is a network or FUSE filesystem"""
+        if fs_type is None:
+            return False
+        fs_type = fs_type.lower()
+        return fs_type in SLOW_FILESYSTEM_TYPES or fs_type.startswith('fuse')
+    
     def _count_items(self, path):
         """Count total number of items to process"""
         # For performance, use a fast estimate rather than deep counting
@@ -103,14 +355,9 @@ class StorageScanner:
             # Root scan - use a reasonable estimate to avoid long counting
             return 10000  # Estimate for progress bar
         
-        count = 0
         try:
-            if os.path.exists(path) and os.path.isdir(path):
-                try:
-                    entries = os.listdir(path)
-                    count = len(entries) * 20  # Quick multiplier estimate
-                except (OSError, PermissionError):
-                    count = 1000  # Default estimate
+            entries = self._listdir(path)
+            count = len(entries) * 20  # Quick multiplier estimate
             print(f"Estimated items to process: {count}")
         except (OSError, PermissionError):
             count = 1000  # Default estimate
@@ -124,30 +371,27 @@ class StorageScanner:
         if self.max_depth is not None and depth > self.max_depth:
             return None
         
-        # Skip excluded directories (exact match or subdirectory)
-        excluded_check = any(path == excluded or path.startswith(excluded + '/') for excluded in self.exclude_dirs)
-        if excluded_check:
-            print(f"Skipping excluded directory: {path}")
+        if self._should_skip_directory(path):
             return None
         
-        # Smart exclusion: check if this looks like a cache/temp directory
-        # but only exclude it if it's small (under 10MB)
-        if self._is_cache_or_temp_dir(path):
-            dir_size = self._quick_directory_size_check(path)
-            if dir_size is not None and dir_size < self.size_check_threshold:
-                print(f"Skipping small cache/temp directory ({self.format_size(dir_size)}): {path}")
-                return None
-            elif dir_size is not None and dir_size >= self.size_check_threshold:
-                print(f"Including large cache/temp directory ({self.format_size(dir_size)}): {path}")
-        
         # Batch processing to prevent browser hangs
         self.processed_count += 1
         if self.processed_count % self.batch_size == 0:
             time.sleep(0.01)  # Small pause every 100 items
         
+        # Initialize directory node
+        node = {
+            "name": os.path.basename(path) or path,
+            "path": path,
+            "size": 0,
+            "children": [],
+            "file_count": 0,
+            "dir_count": 0
+        }
+        
         try:
             # Get directory stats using lstat to avoid following symlinks
-            stat_info = os.lstat(path)
+            stat_info = self._lstat(path)
             if not stat.S_ISDIR(stat_info.st_mode):
                 return None
             
@@ -156,30 +400,26 @@ class StorageScanner:
                 print(f"Skipping different filesystem: {path}")
                 return None
             
-            # Initialize directory node
-            node = {
-                "name": os.path.basename(path) or path,
-                "path": path,
-                "size": 0,
-                "children": [],
-                "file_count": 0,
-                "dir_count": 0
-            }
-            
             # Process directory contents
             try:
-                entries = os.listdir(path)
+                entries = self._listdir(path)
+            except MetadataTimeout:
+                self._mark_incomplete(node, path)
+                progress_callback(path)
+                return node
             except (OSError, PermissionError):
                 progress_callback(path)
                 return node
             
             for entry in entries:
+                if self.stopped:
+                    break
                 entry_path = os.path.join(path, entry)
                 progress_callback(entry_path)
                 
                 try:
                     # Use lstat to avoid following symlinks
-                    entry_stat = os.lstat(entry_path)
+                    entry_stat = self._lstat(entry_path)
                     
                     # Skip symlinks entirely to avoid confusion
                     if stat.S_ISLNK(entry_stat.st_mode):
@@ -190,12 +430,26 @@ class StorageScanner:
                         continue
                     
                     if stat.S_ISDIR(entry_stat.st_mode):
+                        if self.aggregate_below_depth and self.max_depth is not None and depth + 1 > self.max_depth:
+                            # Past the display depth: count the subtree but don't build nodes for it
+                            timeouts_before = len(self.incomplete_paths)
+                            subtree = self._accumulate_directory(entry_path, progress_callback)
+                            if subtree is not None:
+                                node["size"] += subtree[0]
+                                node["dir_count"] += 1
+                                self._add_aggregated(node, subtree)
+                            if len(self.incomplete_paths) > timeouts_before:
+                                node["incomplete"] = True
+                            continue
+                        
                         # Recursively scan subdirectory with incremented depth
                         child_node = self._scan_recursive(entry_path, progress_callback, depth + 1)
                         if child_node:
                             node["children"].append(child_node)
                             node["size"] += child_node["size"]
                             node["dir_count"] += 1
+                            if child_node.get("incomplete"):
+                                node["incomplete"] = True
                     elif stat.S_ISREG(entry_stat.st_mode):
                         # Check for hardlinks to avoid double-counting
                         inode_key = (entry_stat.st_dev, entry_stat.st_ino)
@@ -217,6 +471,9 @@ class StorageScanner:
                         node["size"] += file_size
                         node["file_count"] += 1
                         
+                        if self.track_files:
+                            self._record_file(entry_path, entry_stat)
+                        
                         # Add file as leaf node if it's large enough
                         if file_size > 1024 * 1024:  # Files larger than 1MB
                             file_node = {
@@ -230,41 +487,724 @@ class StorageScanner:
                             }
                             node["children"].append(file_node)
                         
+                except MetadataTimeout:
+                    if self._abandon_directory(node, entry_path):
+                        break
+                    continue
                 except (OSError, PermissionError):
                     # Skip inaccessible files/directories
                     continue
             
-            # Sort children by size (largest first) and limit count
-            node["children"].sort(key=lambda x: x["size"], reverse=True)
-            
-            # Limit children to prevent data explosion - keep only the largest
-            max_children = 50  # Reasonable limit per directory
-            if len(node["children"]) > max_children:
-                total_size_kept = sum(child["size"] for child in node["children"][:max_children])
-                remaining_size = node["size"] - total_size_kept
-                
-                # Add a summary node for remaining items if significant
-                if remaining_size > 0 and len(node["children"]) > max_children:
-                    remaining_count = len(node["children"]) - max_children
-                    summary_node = {
-                        "name": f"... {remaining_count} other items",
-                        "path": f"{path}/...",
-                        "size": remaining_size,
-                        "children": [],
-                        "file_count": 0,
-                        "dir_count": 0,
-                        "is_summary": True
-                    }
-                    node["children"] = node["children"][:max_children] + [summary_node]
-                else:
-                    node["children"] = node["children"][:max_children]
+            self._limit_children(node)
             
             return node
             
+        except MetadataTimeout:
+            # The directory itself didn't answer; keep it as an empty, incomplete node
+            self._mark_incomplete(node, path)
+            progress_callback(path)
+            return node
         except (OSError, PermissionError):
             progress_callback(path)
             return None
     
+    def scan_to_store(self, root_path, store, progress_callback=None):
+        """
+        Scan directory tree into an on-disk ScanStore instead of building it in memory
+        
+        Directory and file records are written in batches as the walk goes and
+        subtree sizes are aggregated afterwards by the store, so memory use
+        doesn't grow with the size of the filesystem. Files over 1MB (or all
+        files, with track_files) are stored; hardlinks are tracked in the store.
+        
+        Args:
+            root_path: Path to scan
+            store: ScanStore to write into
+            progress_callback: Optional callback for progress updates; returning
+                               False stops the scan and leaves a partial store
+            
+        Returns:
+            Summary dictionary for the scan root
+        """
+        root_path = self._prepare_scan(root_path)
+        
+        print(f"Scanning to store: {root_path} -> {store.db_path}")
+        store.root_path = root_path
+        
+        total_items = self._count_items(root_path)
+        processed_items = 0
+        
+        def update_progress(current_path):
+            nonlocal processed_items
+            processed_items += 1
+            if progress_callback:
+                return progress_callback(current_path, processed_items, total_items)
+            return True
+        
+        next_id = 1
+        # Depth-first stack of (dir_id, parent_id, path, depth); only pending siblings are held
+        pending = [(next_id, None, root_path, 0)]
+        stopped = False
+        
+        while pending and not stopped:
+            dir_id, parent_id, path, depth = pending.pop()
+            
+            # The scan root is always recorded, even if it matches an exclusion pattern
+            if parent_id is not None and self._should_skip_directory(path):
+                continue
+            
+            self.processed_count += 1
+            if self.processed_count % self.batch_size == 0:
+                time.sleep(0.01)  # Small pause every 100 items
+            
+            try:
+                entries = self._listdir(path)
+            except (OSError, PermissionError) as e:
+                if isinstance(e, MetadataTimeout):
+                    self._mark_incomplete(None, path)
+                store.add_directory(dir_id, parent_id, depth, path, 0, 0)
+                stopped = update_progress(path) is False
+                continue
+            
+            direct_size = 0
+            file_count = 0
+            for entry in entries:
+                entry_path = os.path.join(path, entry)
+                if update_progress(entry_path) is False:
+                    stopped = True
+                    break
+                
+                try:
+                    entry_stat = self._lstat(entry_path)
+                except MetadataTimeout:
+                    if self._abandon_directory(None, entry_path):
+                        break
+                    continue
+                except (OSError, PermissionError):
+                    continue
+                
+                # Skip symlinks entirely to avoid confusion
+                if stat.S_ISLNK(entry_stat.st_mode):
+                    continue
+                if self.start_filesystem is not None and entry_stat.st_dev != self.start_filesystem:
+                    continue
+                
+                if stat.S_ISDIR(entry_stat.st_mode):
+                    next_id += 1
+                    pending.append((next_id, dir_id, entry_path, depth + 1))
+                elif stat.S_ISREG(entry_stat.st_mode):
+                    # Check for hardlinks to avoid double-counting
+                    if entry_stat.st_nlink > 1 and store.seen_inode(entry_stat.st_dev, entry_stat.st_ino):
+                        continue
+                    
+                    file_size = entry_stat.st_size
+                    direct_size += file_size
+                    file_count += 1
+                    if self.track_files or file_size > 1024 * 1024:
+                        store.add_file(dir_id, entry_path, file_size, entry_stat.st_dev, entry_stat.st_ino)
+            
+            store.add_directory(dir_id, parent_id, depth, path, direct_size, file_count)
+        
+        if stopped:
+            print(f"Scan stopped early with {len(pending)} directories still queued")
+            store.partial = True
+        
+        if store.closed:
+            # Replaced by a newer scan; indexing it would only delay its deletion
+            print(f"Scan store closed, discarding scan of {root_path}")
+            return None
+        
+        summary = store.finalize()
+        if summary:
+            print(f"Scan complete: {summary['name']}")
+            print(f"Total size: {self.format_size(summary['size'])}")
+            print(f"Files: {summary['total_files']}, Directories: {summary['total_dirs']}")
+            if self.incomplete_paths:
+                summary["incomplete_paths"] = list(self.incomplete_paths)
+                print(f"WARNING: {len(self.incomplete_paths)} paths timed out and are incomplete")
+        
+        return summary
+    
+    def _limit_children(self, node):
+        """Sort a node's children by size and fold the tail into a summary node"""
+        # Sort children by size (largest first) and limit count
+        node["children"].sort(key=lambda x: x["size"], reverse=True)
+        
+        # Limit children to prevent data explosion - keep only the largest
+        max_children = 50  # Reasonable limit per directory
+        if len(node["children"]) > max_children:
+            total_size_kept = sum(child["size"] for child in node["children"][:max_children])
+            remaining_size = node["size"] - total_size_kept
+            
+            # Add a summary node for remaining items if significant
+            if remaining_size > 0 and len(node["children"]) > max_children:
+                remaining_count = len(node["children"]) - max_children
+                summary_node = {
+                    "name": f"... {remaining_count} other items",
+                    "path": f"{node['path']}/...",
+                    "size": remaining_size,
+                    "children": [],
+                    "file_count": 0,
+                    "dir_count": 0,
+                    "is_summary": True
+                }
+                node["children"] = node["children"][:max_children] + [summary_node]
+            else:
+                node["children"] = node["children"][:max_children]
+    
+    def _scan_prioritized(self, root_path, progress_callback):
+        """
+        Scan the tree visiting the directories with the largest estimated size first
+        
+        Pending directories sit in a max-heap keyed by estimated subtree size:
+        a size hint from a previous scan when one exists, otherwise the parent's
+        unexplained size split between its subdirectories by link count
+        (roughly their number of subdirectories). The root estimate is the used
+        space of its filesystem. Sizes are propagated to ancestors as each
+        directory is processed, so if progress_callback returns False the
+        partial tree returned already holds the dominant subtrees.
+        """
+        try:
+            fs_stat = self._metadata_call(os.statvfs, root_path)
+            root_estimate = (fs_stat.f_blocks - fs_stat.f_bfree) * fs_stat.f_frsize
+        except (OSError, AttributeError):
+            # Also covers MetadataTimeout; the estimate only orders the heap
+            root_estimate = 0
+        root_estimate = self.size_hints.get(root_path, root_estimate)
+        
+        nodes = {}
+        root = None
+        counter = 0  # Tie-breaker keeps equal estimates in discovery order
+        # Entries: (-estimate, counter, path, depth, parent_path, aggregate_only)
+        pending = [(-root_estimate, counter, root_path, 0, None, False)]
+        
+        def add_size(path, size):
+            # Propagate a size increase from a directory up to the scan root
+            while path is not None:
+                nodes[path]["size"] += size
+                path = os.path.dirname(path) if path != root_path else None
+        
+        while pending:
+            neg_estimate, _, path, depth, parent_path, aggregate_only = heapq.heappop(pending)
+            estimate = -neg_estimate
+            
+            if aggregate_only:
+                # Past the display depth: count the subtree without building nodes
+                timeouts_before = len(self.incomplete_paths)
+                subtree = self._accumulate_directory(path, progress_callback)
+                if len(self.incomplete_paths) > timeouts_before:
+                    nodes[parent_path]["incomplete"] = True
+                if subtree is not None:
+                    nodes[parent_path]["dir_count"] += 1
+                    self._add_aggregated(nodes[parent_path], subtree)
+                    add_size(parent_path, subtree[0])
+                continue
+            
+            if self._should_skip_directory(path):
+                continue
+            
+            self.processed_count += 1
+            if self.processed_count % self.batch_size == 0:
+                time.sleep(0.01)  # Small pause every 100 items
+            
+            try:
+                stat_info = self._lstat(path)
+            except (OSError, PermissionError) as e:
+                if isinstance(e, MetadataTimeout):
+                    self._mark_incomplete(nodes.get(parent_path), path)
+                if progress_callback(path) is False:
+                    break
+                continue
+            if not stat.S_ISDIR(stat_info.st_mode):
+                continue
+            if self.start_filesystem is not None and stat_info.st_dev != self.start_filesystem:
+                print(f"Skipping different filesystem: {path}")
+                continue
+            
+            node = {
+                "name": os.path.basename(path) or path,
+                "path": path,
+                "size": 0,
+                "children": [],
+                "file_count": 0,
+                "dir_count": 0
+            }
+            nodes[path] = node
+            if parent_path is None:
+                root = node
+            else:
+                nodes[parent_path]["children"].append(node)
+                nodes[parent_path]["dir_count"] += 1
+            
+            try:
+                entries = self._listdir(path)
+            except (OSError, PermissionError) as e:
+                if isinstance(e, MetadataTimeout):
+                    self._mark_incomplete(node, path)
+                if progress_callback(path) is False:
+                    break
+                continue
+            
+            direct_size = 0
+            subdirs = []
+            stopped = False
+            for entry in entries:
+                entry_path = os.path.join(path, entry)
+                if progress_callback(entry_path) is False:
+                    stopped = True
+                    break
+                
+                try:
+                    entry_stat = self._lstat(entry_path)
+                except MetadataTimeout:
+                    if self._abandon_directory(node, entry_path):
+                        break
+                    continue
+                except (OSError, PermissionError):
+                    continue
+                
+                # Skip symlinks entirely to avoid confusion
+                if stat.S_ISLNK(entry_stat.st_mode):
+                    continue
+                if self.start_filesystem is not None and entry_stat.st_dev != self.start_filesystem:
+                    continue
+                
+                if stat.S_ISDIR(entry_stat.st_mode):
+                    subdirs.append((entry_path, entry_stat))
+                elif stat.S_ISREG(entry_stat.st_mode):
+                    # Check for hardlinks to avoid double-counting
+                    inode_key = (entry_stat.st_dev, entry_stat.st_ino)
+                    if entry_stat.st_nlink > 1:
+                        if inode_key in self.processed_inodes:
+                            continue
+                        self.processed_inodes.add(inode_key)
+                    
+                    file_size = entry_stat.st_size
+                    direct_size += file_size
+                    node["file_count"] += 1
+                    if self.track_files:
+                        self._record_file(entry_path, entry_stat)
+                    
+                    # Add file as leaf node if it's large enough
+                    if file_size > 1024 * 1024:  # Files larger than 1MB
+                        node["children"].append({
+                            "name": entry,
+                            "path": entry_path,
+                            "size": file_size,
+                            "children": [],
+                            "file_count": 1,
+                            "dir_count": 0,
+                            "is_file": True
+                        })
+            
+            add_size(path, direct_size)
+            if stopped:
+                break
+            
+            # Queue subdirectories, splitting the unexplained estimate by link count
+            child_depth = depth + 1
+            beyond_depth = self.max_depth is not None and child_depth > self.max_depth
+            if beyond_depth and not self.aggregate_below_depth:
+                continue
+            unexplained = max(estimate - direct_size, 0)
+            total_links = sum(max(entry_stat.st_nlink, 1) for _, entry_stat in subdirs)
+            for entry_path, entry_stat in subdirs:
+                child_estimate = self.size_hints.get(entry_path)
+                if child_estimate is None:
+                    child_estimate = unexplained * max(entry_stat.st_nlink, 1) // max(total_links, 1)
+                counter += 1
+                heapq.heappush(pending, (-child_estimate, counter, entry_path, child_depth, path, beyond_depth))
+        
+        # The stop may come while processing the last queued directory, leaving pending empty
+        if self.stopped:
+            print(f"Scan stopped early with {len(pending)} directories still queued")
+            if root is not None:
+                root["partial"] = True
+        
+        # Sort and trim bottom-up once all sizes are final, passing incomplete flags upwards
+        for path in sorted(nodes, key=lambda p: p.count(os.sep), reverse=True):
+            if nodes[path].get("incomplete") and path != root_path:
+                nodes[os.path.dirname(path)]["incomplete"] = True
+            self._limit_children(nodes[path])
+        
+        return root
+    
+    def get_directory_sizes(self, scan_result):
+        """Flatten a scan result into a path -> size map, usable as size_hints"""
+        sizes = {}
+        if not scan_result:
+            return sizes
+        
+        stack = [scan_result]
+        while stack:
+            node = stack.pop()
+            if node.get("is_file") or node.get("is_summary"):
+                continue
+            sizes[node["path"]] = node["size"]
+            stack.extend(node.get("children", []))
+        
+        return sizes
+    
+    def _should_skip_directory(self, path):
+        """Check exclusion rules shared by full and aggregated scanning"""
+        # Skip excluded directories (exact match or subdirectory)
+        excluded_check = any(path == excluded or path.startswith(excluded + '/') for excluded in self.exclude_dirs)
+        if excluded_check:
+            print(f"Skipping excluded directory: {path}")
+            return True
+        
+        # Smart exclusion: check if this looks like a cache/temp directory
+        # but only exclude it if it's small (under 10MB)
+        if self._is_cache_or_temp_dir(path):
+            dir_size = self._quick_directory_size_check(path)
+            if dir_size is not None and dir_size < self.size_check_threshold:
+                print(f"Skipping small cache/temp directory ({self.format_size(dir_size)}): {path}")
+                return True
+            elif dir_size is not None and dir_size >= self.size_check_threshold:
+                print(f"Including large cache/temp directory ({self.format_size(dir_size)}): {path}")
+        
+        return False
+    
+    def _record_file(self, path, stat_info):
+        """Add a regular file to the file index"""
+        self.file_index.append({
+            "path": path,
+            "size": stat_info.st_size,
+            "dev": stat_info.st_dev,
+            "ino": stat_info.st_ino
+        })
+    
+    def _accumulate_directory(self, root_path, progress_callback):
+        """
+        Total the size and entry counts of a subtree without building any tree nodes
+        
+        Applies the same exclusion, mount point, symlink, hardlink and timeout
+        rules as _scan_recursive, walking iteratively so deep trees can't hit
+        the recursion limit. Returns (size, file count, directory count), where
+        the directory count excludes root_path itself, or None if the directory
+        itself is skipped.
+        """
+        if self._should_skip_directory(root_path):
+            return None
+        
+        total_size = 0
+        file_count = 0
+        dir_count = 0
+        pending = [root_path]
+        
+        while pending and not self.stopped:
+            path = pending.pop()
+            progress_callback(path)
+            
+            self.processed_count += 1
+            if self.processed_count % self.batch_size == 0:
+                time.sleep(0.01)  # Same micro-pause as the full scan
+            
+            try:
+                entries = self._listdir(path)
+            except MetadataTimeout:
+                self._mark_incomplete(None, path)
+                continue
+            except (OSError, PermissionError):
+                continue
+            
+            for entry in entries:
+                entry_path = os.path.join(path, entry)
+                try:
+                    entry_stat = self._lstat(entry_path)
+                except MetadataTimeout:
+                    if self._abandon_directory(None, entry_path):
+                        break
+                    continue
+                except (OSError, PermissionError):
+                    continue
+                
+                if stat.S_ISLNK(entry_stat.st_mode):
+                    continue
+                if self.start_filesystem is not None and entry_stat.st_dev != self.start_filesystem:
+                    continue
+                
+                if stat.S_ISDIR(entry_stat.st_mode):
+                    if not self._should_skip_directory(entry_path):
+                        pending.append(entry_path)
+                        dir_count += 1
+                elif stat.S_ISREG(entry_stat.st_mode):
+                    inode_key = (entry_stat.st_dev, entry_stat.st_ino)
+                    if entry_stat.st_nlink > 1:
+                        if inode_key in self.processed_inodes:
+                            continue
+                        self.processed_inodes.add(inode_key)
+                    
+                    total_size += entry_stat.st_size
+                    file_count += 1
+                    if self.track_files:
+                        self._record_file(entry_path, entry_stat)
+        
+        return total_size, file_count, dir_count
+    
+    def _add_aggregated(self, node, subtree):
+        """Record counts from a subtree that was summed without building nodes"""
+        _, file_count, dir_count = subtree
+        node["aggregated"] = True
+        # Entries below the display depth; the subtree roots themselves are in dir_count
+        node["aggregated_file_count"] = node.get("aggregated_file_count", 0) + file_count
+        node["aggregated_dir_count"] = node.get("aggregated_dir_count", 0) + dir_count
+    
+    def preview_directory(self, root_path, progress_callback=None, time_budget=5.0):
+        """
+        Estimate directory tree sizes by sampling entries at each level
+        
+        Each directory lists its entries (cheap, no stat calls), stats a random
+        sample of its files and descends into a random sample of its
+        subdirectories, extrapolating both to the full entry counts. The time
+        budget is split evenly between sampled subdirectories, so the whole
+        preview finishes in roughly time_budget seconds even for /.
+        
+        Args:
+            root_path: Path to scan
+            progress_callback: Optional callback for progress updates
+            time_budget: Approximate number of seconds to spend
+            
+        Returns:
+            Dictionary in the same shape as scan_directory, with "estimated",
+            "size_error" (one standard error) and a 95% "size_low"/"size_high"
+            range on every directory node. Nodes that ran out of time before any
+            subdirectory was sampled, or that contain such nodes, are "truncated":
+            their size is a rough guess and "size_high" is None
+        """
+        root_path = self._prepare_scan(root_path)
+        # Hardlinks are counted once, as in a full scan
+        self.processed_inodes = set()
+        
+        start_time = time.time()
+        visited = 0
+        
+        def update_progress(current_path):
+            nonlocal visited
+            visited += 1
+            if progress_callback:
+                elapsed = time.time() - start_time
+                return progress_callback(current_path, elapsed, time_budget)
+            return True
+        
+        result = self._preview_recursive(root_path, update_progress, start_time + time_budget)
+        
+        if result and self.incomplete_paths:
+            result["incomplete_paths"] = list(self.incomplete_paths)
+        
+        if result:
+            print(f"Preview complete in {time.time() - start_time:.1f}s ({visited} directories listed)")
+            if result.get("truncated"):
+                print(f"Estimated size: {self.format_size(result['size'])} "
+                      f"(at least {self.format_size(result['size_low'])})")
+            else:
+                print(f"Estimated size: {self.format_size(result['size'])} "
+                      f"(+/- {self.format_size(int(1.96 * result['size_error']))})")
+            if result.get("truncated"):
+                print("Time ran out before some subtrees were sampled; their sizes are rough guesses")
+        
+        return result
+    
+    def _preview_recursive(self, path, progress_callback, deadline):
+        """Sample a directory and return an estimated tree node"""
+        excluded_check = any(path == excluded or path.startswith(excluded + '/') for excluded in self.exclude_dirs)
+        if excluded_check:
+            return None
+        
+        try:
+            stat_info = self._lstat(path)
+            if not stat.S_ISDIR(stat_info.st_mode):
+                return None
+            if self.start_filesystem is not None and stat_info.st_dev != self.start_filesystem:
+                return None
+        except MetadataTimeout:
+            self._mark_incomplete(None, path)
+            return None
+        except (OSError, PermissionError):
+            return None
+        
+        # Apply the same small cache/temp exclusion as a full scan so the numbers agree
+        if self._is_cache_or_temp_dir(path):
+            dir_size = self._quick_directory_size_check(path)
+            if dir_size is not None and dir_size < self.size_check_threshold:
+                return None
+        
+        node = {
+            "name": os.path.basename(path) or path,
+            "path": path,
+            "size": 0,
+            "children": [],
+            "file_count": 0,
+            "dir_count": 0,
+            "estimated": True
+        }
+        variance = 0.0
+        
+        # Split entries by type using d_type from scandir, without stat calls
+        files = []
+        dirs = []
+        try:
+            entries = self._metadata_call(self._scandir_list, path)
+        except (OSError, PermissionError) as e:
+            if isinstance(e, MetadataTimeout):
+                self._mark_incomplete(node, path)
+            progress_callback(path)
+            return self._finish_preview_node(node, variance)
+        for entry in entries:
+            try:
+                if entry.is_symlink():
+                    continue
+                if entry.is_dir(follow_symlinks=False):
+                    dirs.append(entry)
+                elif entry.is_file(follow_symlinks=False):
+                    files.append(entry)
+            except OSError:
+                continue
+        
+        if progress_callback(path) is False:
+            return self._finish_preview_node(node, variance)
+        
+        node["file_count"] = len(files)
+        node["dir_count"] = len(dirs)
+        
+        # Files: stat a random sample and extrapolate
+        if len(files) > self.preview_sample_size:
+            sampled_files = self._random.sample(files, self.preview_sample_size)
+        else:
+            sampled_files = files
+        file_sizes = []
+        for entry in sampled_files:
+            try:
+                entry_stat = self._lstat(entry.path)
+            except MetadataTimeout:
+                if self._abandon_directory(node, entry.path):
+                    break  # Extrapolate from the sizes read so far
+                continue
+            except (OSError, PermissionError):
+                continue
+            if entry_stat.st_nlink > 1:
+                inode_key = (entry_stat.st_dev, entry_stat.st_ino)
+                if inode_key in self.processed_inodes:
+                    # Already counted through another link; still a sample, of zero new bytes
+                    file_sizes.append(0)
+                    continue
+                self.processed_inodes.add(inode_key)
+            file_size = entry_stat.st_size
+            file_sizes.append(file_size)
+            if file_size > 1024 * 1024:  # Files larger than 1MB
+                node["children"].append({
+                    "name": entry.name,
+                    "path": entry.path,
+                    "size": file_size,
+                    "children": [],
+                    "file_count": 1,
+                    "dir_count": 0,
+                    "is_file": True
+                })
+        file_estimate, file_variance = self._extrapolate(file_sizes, len(files))
+        node["size"] += file_estimate
+        variance += file_variance
+        
+        # Subdirectories: descend into a random sample, sharing the remaining time
+        # Shuffled order makes whatever prefix fits in the time budget a random sample
+        sample_count = len(dirs)
+        if self.preview_dir_sample is not None:
+            sample_count = min(sample_count, self.preview_dir_sample)
+        sampled_dirs = self._random.sample(dirs, sample_count)
+        dir_sizes = []
+        dir_variances = []
+        sampled_dir_total = 0
+        for index, entry in enumerate(sampled_dirs):
+            now = time.time()
+            if now >= deadline:
+                break
+            child_deadline = now + (deadline - now) / (len(sampled_dirs) - index)
+            child_node = self._preview_recursive(entry.path, progress_callback, child_deadline)
+            if child_node is None:
+                # Excluded or on another filesystem - contributes nothing, as in a full scan
+                dir_sizes.append(0)
+                dir_variances.append(0.0)
+                continue
+            if child_node.get("incomplete"):
+                node["incomplete"] = True
+            if child_node.get("truncated"):
+                node["truncated"] = True
+            dir_sizes.append(child_node["size"])
+            dir_variances.append(child_node["size_error"] ** 2)
+            sampled_dir_total += child_node["size"]
+            node["children"].append(child_node)
+        
+        if dirs and not dir_sizes:
+            # Out of time before any subdirectory could be sampled
+            node["truncated"] = True
+            dir_estimate, dir_variance = self._fallback_estimate(dirs)
+        else:
+            dir_estimate, dir_variance = self._extrapolate(dir_sizes, len(dirs))
+            # Two-stage sampling: subtree estimates carry their own error
+            dir_variance += (len(dirs) / len(dir_sizes)) * sum(dir_variances) if dir_sizes else 0.0
+        node["size"] += dir_estimate
+        variance += dir_variance
+        
+        if dirs:
+            unsampled_estimate = dir_estimate - sampled_dir_total
+            if unsampled_estimate > 0:
+                remaining_count = len(dirs) - len(dir_sizes)
+                node["children"].append({
+                    "name": f"... {remaining_count} other directories (estimated)",
+                    "path": f"{path}/...",
+                    "size": unsampled_estimate,
+                    "children": [],
+                    "file_count": 0,
+                    "dir_count": 0,
+                    "is_summary": True,
+                    "estimated": True
+                })
+        
+        node["children"].sort(key=lambda x: x["size"], reverse=True)
+        return self._finish_preview_node(node, variance)
+    
+    def _extrapolate(self, sample, population):
+        """Estimate a population total and its variance from a simple random sample"""
+        n = len(sample)
+        if n == 0 or population == 0:
+            return 0, 0.0
+        mean = sum(sample) / n
+        estimate = mean * population
+        if n >= population:
+            return sum(sample), 0.0  # Exact, without float rounding
+        if n == 1:
+            # No spread information - assume the estimate could be off by itself
+            return int(estimate), float(estimate) ** 2
+        sample_variance = sum((value - mean) ** 2 for value in sample) / (n - 1)
+        # Finite population correction: sampling most of a directory leaves little error
+        variance = population ** 2 * (1 - n / population) * sample_variance / n
+        return int(estimate), variance
+    
+    def _fallback_estimate(self, dirs):
+        """
+        Estimate the total size of subdirectories that were never sampled
+        
+        A few of them get a one-level size check. That misses anything nested
+        deeper, so the estimate leans low; each directory is allowed an error of
+        its checked size or the small-directory threshold, whichever is larger.
+        The result is a rough guess, not a sample with a known spread.
+        """
+        checked = self._random.sample(dirs, min(len(dirs), self.preview_fallback_sample))
+        sizes = [size for size in (self._quick_directory_size_check(entry.path) for entry in checked)
+                 if size is not None]
+        mean = sum(sizes) / len(sizes) if sizes else 0
+        error = max(mean, self.size_check_threshold) * len(dirs)
+        return int(mean * len(dirs)), float(error) ** 2
+    
+    def _finish_preview_node(self, node, variance):
+        """Attach error bounds to an estimated node"""
+        error = math.sqrt(variance)
+        node["size_error"] = error
+        node["size_low"] = max(int(node["size"] - 1.96 * error), 0)
+        # Unsampled subtrees can hide any amount of data, so there is no upper bound
+        node["size_high"] = None if node.get("truncated") else int(node["size"] + 1.96 * error)
+        return node
+    
     def get_top_directories(self, scan_result, limit=20):
         """Get top directories by size"""
         if not scan_result:
@@ -331,13 +1271,13 @@ class StorageScanner:
             item_count = 0
             max_items_to_check = 50  # Only check first 50 items for speed
             
-            for entry in os.listdir(path):
+            for entry in self._listdir(path):
                 if item_count >= max_items_to_check:
                     break
                     
                 entry_path = os.path.join(path, entry)
                 try:
-                    stat_info = os.lstat(entry_path)
+                    stat_info = self._lstat(entry_path)
                     if stat.S_ISREG(stat_info.st_mode):
                         total_size += stat_info.st_size
                     item_count += 1
@@ -347,7 +1287,7 @@ class StorageScanner:
             # If we hit the limit, estimate the total by extrapolating
             if item_count >= max_items_to_check:
                 try:
-                    total_items = len(os.listdir(path))
+                    total_items = len(self._listdir(path))
                     if total_items > max_items_to_check:
                         total_size = total_size * (total_items / max_items_to_check)
                 except (OSError, PermissionError):
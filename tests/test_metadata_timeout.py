@@ -0,0 +1,183 @@
+"""
+Timeout guard tests
+Injects delays into metadata calls to stand in for a hung network mount
+"""
+
+import os
+import time
+import shutil
+import tempfile
+import threading
+import unittest
+from unittest import mock
+
+import scanner
+from scanner import StorageScanner, MetadataWorkerPool, MetadataTimeout
+from scan_store import ScanStore
+
+
+class HangingFilesystem:
+    """Wraps os.lstat and os.listdir so calls on hung paths block until released"""
+
+    def __init__(self, hung_paths):
+        self.hung_paths = set(hung_paths)
+        self.release = threading.Event()
+        self.calls = []
+        self._lstat = os.lstat
+        self._listdir = os.listdir
+
+    def _wait(self, path):
+        self.calls.append(path)
+        if os.fspath(path) in self.hung_paths:
+            self.release.wait(30)
+
+    def lstat(self, path, *args, **kwargs):
+        self._wait(path)
+        return self._lstat(path, *args, **kwargs)
+
+    def listdir(self, path='.'):
+        self._wait(path)
+        return self._listdir(path)
+
+    def patch(self):
+        return mock.patch.multiple(scanner.os, lstat=self.lstat, listdir=self.listdir)
+
+
+class TimeoutGuardTest(unittest.TestCase):
+    def setUp(self):
+        # Under the home directory: /tmp paths are skipped as small temp directories
+        self.root = tempfile.mkdtemp(prefix="vizdisk-test-", dir=os.path.expanduser("~"))
+        for name in ("local", "mount"):
+            os.makedirs(os.path.join(self.root, name, "inner"))
+            with open(os.path.join(self.root, name, "data.bin"), "wb") as f:
+                f.write(b"x" * 4096)
+        self.mount = os.path.join(self.root, "mount")
+        self.hung = None
+
+    def tearDown(self):
+        if self.hung is not None:
+            self.hung.release.set()
+        shutil.rmtree(self.root, ignore_errors=True)
+
+    def _mounts(self, root_type):
+        return [("/", root_type), (self.root, root_type), (self.mount, "nfs")]
+
+    def test_hung_mount_below_local_root_is_skipped(self):
+        self.hung = HangingFilesystem([self.mount])
+        scan = StorageScanner(metadata_timeout=0.5)
+        with mock.patch.object(StorageScanner, "_read_mounts", return_value=self._mounts("ext4")), \
+                self.hung.patch():
+            start = time.time()
+            result = scan.scan_directory(self.root)
+
+        self.assertLess(time.time() - start, 5)
+        self.assertNotIn(self.mount, self.hung.calls)
+        self.assertEqual(result["size"], 4096)
+        self.assertFalse(result.get("incomplete"))
+
+    def test_hung_mount_on_slow_root_is_marked_incomplete(self):
+        hung_dir = os.path.join(self.root, "local")
+        self.hung = HangingFilesystem([hung_dir])
+        # Only the mount at hung_dir hangs, so its siblings must still be read
+        mounts = [("/", "ext4"), (self.root, "fuse.sshfs"), (hung_dir, "ext4")]
+        for schedule in ("listdir", "largest_first"):
+            scan = StorageScanner(metadata_timeout=0.5, schedule=schedule)
+            with mock.patch.object(StorageScanner, "_read_mounts", return_value=mounts), \
+                    self.hung.patch():
+                start = time.time()
+                result = scan.scan_directory(self.root)
+
+            self.assertLess(time.time() - start, 5, schedule)
+            self.assertTrue(result.get("incomplete"), schedule)
+            self.assertIn(hung_dir, result["incomplete_paths"], schedule)
+            self.assertEqual(result["size"], 4096, schedule)
+
+    def test_hung_entries_cost_one_timeout_per_directory(self):
+        hung_dir = os.path.join(self.root, "local")
+        hung_files = [os.path.join(hung_dir, f"hung-{index}") for index in range(20)]
+        for hung_file in hung_files:
+            open(hung_file, "wb").close()
+        self.hung = HangingFilesystem(hung_files)
+        mounts = [("/", "ext4"), (self.root, "fuse.sshfs")]
+        walks = {
+            "listdir": {},
+            "largest_first": {"schedule": "largest_first"},
+            "aggregated": {"max_depth": 0, "aggregate_below_depth": True},
+            "store": {},
+        }
+        for walk, options in walks.items():
+            scan = StorageScanner(metadata_timeout=0.3, **options)
+            with mock.patch.object(StorageScanner, "_read_mounts", return_value=mounts), \
+                    self.hung.patch():
+                start = time.time()
+                if walk == "store":
+                    store = ScanStore()
+                    result = scan.scan_to_store(self.root, store)
+                    store.close()
+                else:
+                    result = scan.scan_directory(self.root)
+
+            self.assertLess(time.time() - start, 3, walk)
+            # Only the first hung entry was waited on
+            self.assertEqual(len(result["incomplete_paths"]), 1, walk)
+            self.assertIn(result["incomplete_paths"][0], hung_files, walk)
+
+
+class MetadataWorkerPoolTest(unittest.TestCase):
+    def setUp(self):
+        self.release = threading.Event()
+        self.calls = []
+
+    def tearDown(self):
+        self.release.set()
+
+    def _hang(self, arg):
+        self.calls.append(arg)
+        self.release.wait(30)
+        return arg
+
+    def test_timed_out_call_is_not_resubmitted(self):
+        pool = MetadataWorkerPool(workers=2, max_hung=4)
+        with self.assertRaises(MetadataTimeout):
+            pool.call(self._hang, "dead", timeout=0.2, retries=3)
+        time.sleep(0.2)
+        self.assertEqual(self.calls, ["dead"])
+
+    def test_unreplaced_worker_rejoins_pool(self):
+        pool = MetadataWorkerPool(workers=2, max_hung=1)
+        for path in ("dead-1", "dead-2"):
+            with self.assertRaises(MetadataTimeout):
+                pool.call(self._hang, path, timeout=0.2)
+        self.assertEqual(pool.hung, 1)
+
+        self.release.set()
+        time.sleep(0.2)
+        self.assertEqual(pool.hung, 0)
+
+        # Both remaining workers must still serve calls concurrently
+        barrier = threading.Barrier(2, timeout=2)
+        results = []
+        callers = [threading.Thread(target=lambda: results.append(pool.call(barrier.wait, None, timeout=2)))
+                   for _ in range(2)]
+        for caller in callers:
+            caller.start()
+        for caller in callers:
+            caller.join()
+        self.assertEqual(len(results), 2)
+
+    def test_transient_errors_are_retried(self):
+        pool = MetadataWorkerPool(workers=1)
+        attempts = []
+
+        def flaky(arg):
+            attempts.append(arg)
+            if len(attempts) < 3:
+                raise OSError(scanner.errno.EIO, "I/O error", arg)
+            return "ok"
+
+        self.assertEqual(pool.call(flaky, "path", timeout=1, retries=2), "ok")
+        self.assertEqual(len(attempts), 3)
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,148 @@
+"""
+Query tests
+Checks ScanIndex and ScanStore queries against a brute-force filter over the same tree
+"""
+
+import fnmatch
+import random
+import unittest
+
+from scan_index import ScanIndex
+from scan_store import ScanStore
+
+
+def build_tree(seed=7):
+    """Build a random tree of a few hundred entries in the StorageScanner result format"""
+    rng = random.Random(seed)
+    names = ["app.log", "cache.db", "Cache", "readme.TXT", ".log", "data.tar.gz", "lib.so", "notes", "x.log"]
+
+    def make_dir(path, depth):
+        node = {"name": path.rsplit('/', 1)[-1] or path, "path": path, "size": 0,
+                "children": [], "file_count": 0, "dir_count": 0}
+        for index in range(rng.randint(0, 6)):
+            name = f"{index}-{rng.choice(names)}"
+            size = rng.choice([0, 1, 512, 4096, 4096, 1 << 20, rng.randint(1, 1 << 24)])
+            node["children"].append({"name": name, "path": f"{path.rstrip('/')}/{name}", "size": size,
+                                     "children": [], "file_count": 1, "dir_count": 0, "is_file": True})
+            node["size"] += size
+            node["file_count"] += 1
+        if depth < 4:
+            for index in range(rng.randint(1, 5)):
+                name = rng.choice(["src", "cache", "var", "var-old", "logs.d"]) + str(index)
+                child = make_dir(f"{path.rstrip('/')}/{name}", depth + 1)
+                node["children"].append(child)
+                node["size"] += child["size"]
+                node["dir_count"] += 1
+        return node
+
+    return make_dir("/data", 0)
+
+
+def flatten(tree):
+    entries = []
+    stack = [tree]
+    while stack:
+        node = stack.pop()
+        entries.append(node)
+        stack.extend(node["children"])
+    return entries
+
+
+def brute_force(entries, min_size=None, max_size=None, prefix=None, pattern=None, kind=None,
+                offset=0, limit=100):
+    """Return the sizes on the requested page and the exact match count"""
+    if prefix:
+        prefix = prefix.rstrip('/') or '/'
+    matches = []
+    for entry in entries:
+        if min_size is not None and entry["size"] < min_size:
+            continue
+        if max_size is not None and entry["size"] > max_size:
+            continue
+        if prefix and prefix != '/' and entry["path"] != prefix and not entry["path"].startswith(prefix + '/'):
+            continue
+        if kind == "file" and not entry.get("is_file"):
+            continue
+        if kind == "directory" and entry.get("is_file"):
+            continue
+        if pattern and not fnmatch.fnmatchcase(entry["name"].lower(), pattern.lower()):
+            continue
+        matches.append(entry["size"])
+    matches.sort(reverse=True)
+    return matches[offset:offset + limit], len(matches)
+
+
+def random_queries(count, seed=11):
+    rng = random.Random(seed)
+    queries = [{"min_size": 5 << 20, "max_size": 1 << 20}, {}, {"offset": 10 ** 6}]
+    for _ in range(count):
+        query = {}
+        if rng.random() < 0.4:
+            query["min_size"] = rng.choice([0, 1, 4096, 1 << 20, 10 ** 12])
+        if rng.random() < 0.3:
+            query["max_size"] = rng.choice([0, 4096, 1 << 20, 1 << 30])
+        if rng.random() < 0.5:
+            query["prefix"] = rng.choice(["/", "/data", "/data/", "/data/var0", "/data/var1/cache0",
+                                          "/data/src1", "/missing"])
+        if rng.random() < 0.4:
+            query["pattern"] = rng.choice(["*.log", "*.LOG", "*cache*", "*.tar.gz", "*-notes", "?-*"])
+        if rng.random() < 0.3:
+            query["kind"] = rng.choice(["file", "directory"])
+        query["offset"] = rng.choice([0, 0, 0, 3, 20, 5000])
+        query["limit"] = rng.choice([1, 5, 100])
+        queries.append(query)
+    return queries
+
+
+class QueryTestMixin:
+    def check(self, query_func, entries):
+        for query in random_queries(400):
+            with self.subTest(query=query):
+                result = query_func(**query)
+                page, total = brute_force(entries, **query)
+                # Equal sizes may come in either order, so compare sizes rather than paths
+                self.assertEqual([entry["size"] for entry in result["results"]], page)
+                if result["total_exact"]:
+                    self.assertEqual(result["total"], total)
+                else:
+                    self.assertGreater(result["total"], query.get("offset", 0) + query.get("limit", 100))
+                    self.assertLessEqual(result["total"], total)
+
+
+class ScanIndexQueryTest(QueryTestMixin, unittest.TestCase):
+    def test_matches_brute_force(self):
+        tree = build_tree()
+        self.check(ScanIndex(tree).query, flatten(tree))
+
+    def test_inverted_size_range_is_empty(self):
+        result = ScanIndex(build_tree()).query(min_size=5 << 20, max_size=1 << 20)
+        self.assertEqual(result["total"], 0)
+        self.assertEqual(result["results"], [])
+
+
+class ScanStoreQueryTest(QueryTestMixin, unittest.TestCase):
+    def setUp(self):
+        self.tree = build_tree()
+        self.store = ScanStore()
+        next_id = 0
+        pending = [(self.tree, None, 0)]
+        while pending:
+            node, parent_id, depth = pending.pop()
+            next_id += 1
+            files = [child for child in node["children"] if child.get("is_file")]
+            self.store.add_directory(next_id, parent_id, depth, node["path"],
+                                     sum(child["size"] for child in files), len(files))
+            for child in files:
+                self.store.add_file(next_id, child["path"], child["size"], 1, hash(child["path"]))
+            pending.extend((child, next_id, depth + 1) for child in node["children"] if not child.get("is_file"))
+        self.store.finalize()
+
+    def tearDown(self):
+        self.store.close()
+
+    def test_matches_brute_force(self):
+        self.check(self.store.query, flatten(self.tree))
+
+
+if __name__ == '__main__':
+    unittest.main()